@@ -4,6 +4,9 @@
 import random
 from typing import override
 
+import numpy
+import pandas
+
 import utils
 
 
@@ -11,40 +14,57 @@ class Athlete:
     """Store information about a athlete"""
 
     # Values
+    index = -1  # Position in Simulation.all_athletes
     rank = -1
     time = 0.0
     distance = 0.0
     avg_speed = 0.0
+    speed = 0.0  # Speed during the last step
     dt = 0.0
 
     # Used with season
     total_time = 0.0
     total_distance = 0.0
 
+    # Parsed once, see start_time and cross_time
+    _start_time: float | None = None
+    _cross_time: float | None = None
+    # Start given by the simulation instead of the jump (wave and mass starts)
+    start: float | None = None
+
     # Slipstream
     boost = utils.Boost()
     energy = 100.0
     locked = False  # Control the ability to get the boost
     in_slipstream = False
+    leader: "Athlete | None" = None  # Athlete we are drafting behind
 
-    # Plot energy expenditure
-    # For some reason, all athletes share the same 'energies' list
-    energies: dict[str, list[float]] = {}
-    speeds: dict[str, list[float]] = {}
-    s = 0.0
+    # Random numbers of the simulation, the random module is used if not set
+    stream: utils.RandomStream | None = None
 
     def __init__(
-        self, name: str, dt: float, data: dict[str, str], random: bool = False
+        self,
+        name: str,
+        dt: float,
+        data: "dict[str, str] | TableRow",
+        random: bool = False,
     ) -> None:
         self.name = name
         self.dt = dt
         self.data = data
-        self.starting_place = int(self.get("jump_rank"))
         self.random = random
-        r = self.get("rank")
-        if (type(r) == str) and (r[:3] == "PF "):
-            r = r[3:]
-        self.expected_rank = int(r)
+        # Each athlete needs its own boost, a class attribute would be shared
+        self.boost = utils.Boost()
+        if type(data) == TableRow:
+            # Already parsed by the table
+            record = data.table.records[data.i]
+            self.starting_place = int(record["starting_place"])
+            self.expected_rank = int(record["expected_rank"])
+            self._start_time = float(record["start_time"])
+            self._cross_time = float(record["cross_duration"])
+        else:
+            self.starting_place = int(self.get("jump_rank"))
+            self.expected_rank = utils.rank_convert_to_int(self.get("rank"))
 
     @override
     def __str__(self) -> str:
@@ -81,7 +101,10 @@ class Athlete:
         m = 1.0
         if self.random and (speed is None):
             # Add some random to the speed of the athlete
-            m = 1 + (random.random() - 0.5) / 5
+            if self.stream is not None:
+                m = 1 + (self.stream.random() - 0.5) / 5
+            else:
+                m = 1 + (random.random() - 0.5) / 5
         s *= m
 
         # If in slipstream, recover some energy
@@ -113,20 +136,7 @@ class Athlete:
         self.distance += s * dt
         self.time = round(self.time + dt, 3)
         self.energy = round(self.energy, 6)
-
-        self.s += s
-        # if round(self.time, 0) == self.time:
-        # Record energy level every 30 seconds
-        if self.name in self.speeds:
-            self.speeds[self.name].append(self.s)
-        else:
-            self.speeds[self.name] = [self.s]
-        self.s = 0
-
-        if self.name in self.energies:
-            self.energies[self.name].append(self.energy)
-        else:
-            self.energies[self.name] = [self.energy]
+        self.speed = s
 
     def can_boost(self) -> bool:
         return (not self.locked) and (self.energy > 50)
@@ -141,4 +151,77 @@ class Athlete:
             raise TypeError(f"'{other}' is not an instance of Athlete")
 
     def start_time(self) -> float:
-        return utils.time_convert_to_float(self.get("jump_time_diff"))
+        if self.start is not None:
+            return self.start
+        if self._start_time is None:
+            self._start_time = utils.time_convert_to_float(self.get("jump_time_diff"))
+        return self._start_time
+
+    def cross_time(self) -> float:
+        """Time taken for the cross country in the real race"""
+        if self._cross_time is None:
+            self._cross_time = utils.time_convert_to_float(self.get("cross_time"))
+        return self._cross_time
+
+
+class AthleteTable:
+    """All the athletes of a race, one record per athlete in a NumPy structured array.
+    The columns of the csv are kept as strings, and the values used by the
+    simulation are parsed once when the table is created:
+    start_time and cross_duration (in seconds), expected_rank and starting_place"""
+
+    __slots__ = ("records", "columns")
+
+    parsed = [
+        ("start_time", numpy.float64),
+        ("cross_duration", numpy.float64),
+        ("expected_rank", numpy.int32),
+        ("starting_place", numpy.int32),
+    ]
+
+    def __init__(self, records: numpy.ndarray, columns: tuple[str, ...]) -> None:
+        self.records = records
+        self.columns = columns
+
+    @classmethod
+    def from_frame(cls, data: pandas.DataFrame) -> "AthleteTable":
+        """Parse all the records of the csv read by pandas"""
+        columns = tuple(str(c) for c in data.columns)
+        raw = {c: data[c].fillna("").astype(str).to_numpy(dtype=str) for c in columns}
+
+        dtype = [(c, raw[c].dtype) for c in columns] + cls.parsed
+        records = numpy.empty(len(data), dtype=dtype)
+        for c in columns:
+            records[c] = raw[c]
+        records["start_time"] = [
+            utils.time_convert_to_float(t) for t in raw["jump_time_diff"]
+        ]
+        records["cross_duration"] = [
+            utils.time_convert_to_float(t) for t in raw["cross_time"]
+        ]
+        records["expected_rank"] = [utils.rank_convert_to_int(r) for r in raw["rank"]]
+        records["starting_place"] = raw["jump_rank"].astype(int)
+        return cls(records, columns)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def names(self) -> list[str]:
+        return self.records["name"].tolist()
+
+    def row(self, i: int) -> "TableRow":
+        return TableRow(self, i)
+
+
+class TableRow:
+    """The i-th athlete of a table, can be used as the data of an Athlete"""
+
+    __slots__ = ("table", "i")
+
+    def __init__(self, table: AthleteTable, i: int) -> None:
+        self.table = table
+        self.i = i
+
+    def __getitem__(self, name: str) -> str:
+        return str(self.table.records[name][self.i])
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import startlist
+import utils
+
+history_path = "benchmark_history.json"
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+DEFAULT_SPREADS = [30, 120]
+DEFAULT_DISTANCES = [5, 10]
+# With ":fixed", the random factors of the speeds are turned off, as in EventSim
+DEFAULT_ENGINES = [
+    "SimpleSim",
+    "SlipstreamSim",
+    "VectorSim",
+    "VectorSim:fixed",
+    "EventSim",
+]
+DEFAULT_MAX_STEPS = 4000
+
+
+def write_race(path: str, size: int, spread: int, km: int, seed: int = 0) -> None:
+    """Write a synthetic race of 'size' athletes in the schema of extracted/.
+    The jump time differences are spread over 'spread' seconds, and the cross
+    country times are around 2:30 per km"""
+    rng = random.Random(seed)
+    starts = sorted(rng.randint(0, spread) for _ in range(size))
+    cross = [150 * km + rng.gauss(0, 6 * km) for _ in range(size)]
+    finish = sorted(range(size), key=lambda k: starts[k] + cross[k])
+    ranks = [0] * size
+    for r, k in enumerate(finish):
+        ranks[k] = r + 1
+    with open(path, "w") as f:
+        f.write(startlist.HEADER + "\n")
+        for k in range(size):
+            jump = f"{starts[k] // 60}:{starts[k] % 60:02}"
+            c = cross[k]
+            f.write(
+                f"ATHLETE{k:05} Bench,NOR,Club,01 01 2000,{ranks[k]},{k + 1},100,"
+                f"{k + 1},{jump},{int(c // 60)}:{c % 60:04.1f},{ranks[k]},+0\n"
+            )
+
+
+def race_name(size: int, spread: int, km: int) -> str:
+    """File name of a synthetic race, with the distance where read_distance finds it"""
+    return f"{size:05} Bench {spread}s_{km}.0.csv"
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+        commit = out.stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+        )
+        if status.stdout.strip() != "":
+            commit += "-dirty"
+        return commit if out.returncode == 0 else "unknown"
+    except FileNotFoundError:
+        return "unknown"
+
+
+def run_child(engine: str, path: str, max_steps: int) -> dict:
+    """Simulate the race with the engine (a class of simulation.py, with ":fixed" to
+    turn off the random factors) in this process, return the measures. Used in a separate process, so that the peak memory is the
+    one of this run only"""
+    import cache
+    import simulation
+
+    # Do not fill the cache of extracted/ with the synthetic races
+    cache.cache_dir = os.path.join(os.path.dirname(path), ".cache")
+    start = time.perf_counter()
+    name, _, mode = engine.partition(":")
+    sim = getattr(simulation, name)(0.05, name=os.devnull)
+    if mode == "fixed":
+        sim.use_random = False
+    # Nothing is rendered, EventSim can jump over the seconds
+    sim.every_frame = False
+    sim.load_csv(path)
+    sim.start()
+    load = time.perf_counter() - start
+
+    # Steps of dt simulated: an update of EventSim can do many of them
+    steps = 0
+    updates = 0
+    athletes = 0
+    start = time.perf_counter()
+    while (not sim.ended) and ((max_steps == 0) or (steps < max_steps)):
+        sim.update()
+        updates += 1
+        athletes += sim.num_skiing() * (sim.tick - steps)
+        steps = sim.tick
+    wall = time.perf_counter() - start
+
+    return {
+        "load": load,
+        "steps": steps,
+        "updates": updates,
+        "wall": wall,
+        "finished": sim.ended,
+        "steps_per_second": steps / max(wall, 1e-9),
+        "athletes_per_step": athletes / max(steps, 1),
+        # In kB on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_benchmark(engine: str, path: str, max_steps: int) -> dict:
+    """Run run_child in a new python process"""
+    command = [sys.executable, __file__, "--child", engine, path, str(max_steps)]
+    out = subprocess.run(command, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"{engine} failed on {path}:\n{out.stderr}")
+    # The simulation prints its progress before the result
+    return json.loads(out.stdout.strip().split("\n")[-1])
+
+
+def read_history(path: str = history_path) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_history(entry: dict, path: str = history_path) -> None:
+    history = read_history(path)
+    history.append(entry)
+    with open(path, "w") as f:
+        json.dump(history, f, indent=1)
+
+
+def previous_results(history: list[dict]) -> dict[tuple, dict]:
+    """Last result of each benchmark in the history. Only the results with the
+    same max_steps can be compared"""
+    results = {}
+    for entry in history:
+        for r in entry["results"]:
+            key = (r["engine"], r["size"], r["spread"], r["km"], r["max_steps"])
+            results[key] = r
+    return results
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) == 5) and (sys.argv[1] == "--child"):
+        print("\n" + json.dumps(run_child(sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+        exit(0)
+
+    sizes = DEFAULT_SIZES
+    spreads = DEFAULT_SPREADS
+    distances = DEFAULT_DISTANCES
+    engines = DEFAULT_ENGINES
+    max_steps = DEFAULT_MAX_STEPS
+    path = history_path
+    save = True
+    k = 1
+    while k < len(sys.argv):
+        arg = sys.argv[k]
+        if arg == "--sizes":
+            k += 1
+            sizes = [int(v) for v in sys.argv[k].split(",")]
+        elif arg == "--spreads":
+            k += 1
+            spreads = [int(v) for v in sys.argv[k].split(",")]
+        elif arg == "--distances":
+            k += 1
+            distances = [int(v) for v in sys.argv[k].split(",")]
+        elif arg == "--engines":
+            k += 1
+            engines = sys.argv[k].split(",")
+        elif arg == "--max-steps":
+            k += 1
+            max_steps = int(sys.argv[k])
+        elif arg == "--history":
+            k += 1
+            path = sys.argv[k]
+        elif arg == "--no-save":
+            save = False
+        elif (arg == "-h") or (arg == "--help"):
+            print("Help for benchmark.py")
+            print("Time the simulations on synthetic races, and save the results\n")
+            print("  --sizes [int,...]     Athletes per race")
+            print("                        (default: 10,100,1000,5000)")
+            print("  --spreads [int,...]   Seconds between the first and last start")
+            print("                        (default: 30,120)")
+            print("  --distances [int,...] Distances in km (default: 5,10)")
+            print("  --engines [str,...]   Classes of simulation.py to time, with")
+            print("                        :fixed to turn off the random factors")
+            print("                        (default: " + ",".join(engines) + ")")
+            print("  --max-steps [int]     Stop a race after this number of steps,")
+            print(f"                        0 for all (default: {max_steps})")
+            print(f"  --history [str]       History file (default: {history_path})")
+            print("  --no-save             Do not add the results to the history")
+            exit(0)
+        else:
+            print(f"Unknow argument {arg}")
+            exit(1)
+        k += 1
+
+    previous = previous_results(read_history(path))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            for spread in spreads:
+                for km in distances:
+                    race = os.path.join(tmp, race_name(size, spread, km))
+                    write_race(race, size, spread, km)
+                    for engine in engines:
+                        r = run_benchmark(engine, race, max_steps)
+                        r.update(engine=engine, size=size, spread=spread, km=km)
+                        r["max_steps"] = max_steps
+                        results.append(r)
+
+                        text = (
+                            f"{engine:15} {size:5} athletes, {spread:4}s, {km:2}km: "
+                            f"{r['steps_per_second']:9.1f} steps/s, "
+                            f"{utils.time_convert_to_str(r['wall'])} for "
+                            f"{r['steps']} steps{'' if r['finished'] else ' (cut)'}, "
+                            f"{r['peak_rss'] / 1024:.0f}MB"
+                        )
+                        key = (engine, size, spread, km, max_steps)
+                        if key in previous:
+                            ratio = r["steps_per_second"] / max(
+                                previous[key]["steps_per_second"], 1e-9
+                            )
+                            text += f", x{ratio:.2f} vs last run"
+                        print(text)
+
+    if save:
+        write_history(
+            {
+                "commit": git_commit(),
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "max_steps": max_steps,
+                "results": results,
+            },
+            path,
+        )
+        print(f"Results added to {path}")
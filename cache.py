@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import glob
+import hashlib
+import os
+
+import numpy
+import pandas
+
+import athlete
+
+cache_dir = os.path.join("extracted", ".cache")
+
+
+def cache_key(path_file: str) -> str:
+    """Hash of the absolute path of a file, used to name its cached version"""
+    return hashlib.sha1(os.path.abspath(path_file).encode()).hexdigest()[:20]
+
+
+def cache_path(path_file: str) -> str:
+    """Path of the cached table, changes when the csv is modified"""
+    mtime = os.stat(path_file).st_mtime_ns
+    return os.path.join(cache_dir, f"{cache_key(path_file)}-{mtime}.npy")
+
+
+def read_table(path_file: str) -> athlete.AthleteTable:
+    """Return the table of a race csv. Use the cached records if the csv did not
+    change since they were written, otherwise parse the csv and cache it.
+    The cached records are memory mapped, so they are read only."""
+    path_cache = cache_path(path_file)
+    if os.path.exists(path_cache):
+        records = numpy.load(path_cache, mmap_mode="r")
+        parsed = [p for p, _ in athlete.AthleteTable.parsed]
+        columns = tuple(c for c in records.dtype.names if c not in parsed)
+        return athlete.AthleteTable(records, columns)
+
+    table = athlete.AthleteTable.from_frame(pandas.read_csv(path_file))
+    write_table(path_file, path_cache, table)
+    return table
+
+
+def write_table(path_file: str, path_cache: str, table: athlete.AthleteTable) -> None:
+    """Write the records, and remove the ones of older versions of the csv"""
+    os.makedirs(cache_dir, exist_ok=True)
+    # Other processes may read the cache at the same time, so write it then move it
+    tmp = f"{path_cache}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        numpy.save(f, table.records, allow_pickle=False)
+    os.replace(tmp, path_cache)
+    # Only the older versions, another process may be about to load path_cache
+    for old in glob.glob(os.path.join(cache_dir, f"{cache_key(path_file)}-*.npy")):
+        if old == path_cache:
+            continue
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            # Removed by another process
+            pass
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import time
+
+import numpy
+
+import simulation
+import utils
+
+DEFAULT_STEPS = [0.05, 0.1, 0.2, 0.25, 0.5]
+DEFAULT_REFERENCE = 0.01
+DEFAULT_INTEGRATORS = ["euler", "adaptive"]
+DEFAULT_REPLICAS = 50
+
+
+def run_ensemble(
+    path: str,
+    dt: float,
+    replicas: int,
+    seed: int,
+    integrator: str = "euler",
+    tolerance: float = simulation.Simulation.tolerance,
+    use_random: bool = True,
+) -> tuple[numpy.ndarray, numpy.ndarray, float]:
+    """Simulate the race with an EnsembleSim, return the finishing times and ranks
+    (one row per replica) and the wall time"""
+    sim = simulation.EnsembleSim(dt, name=os.devnull, seed=seed, replicas=replicas)
+    sim.load_csv(path)
+    sim.use_random = use_random
+    sim.set_integrator(integrator, tolerance)
+    sim.start()
+    start = time.perf_counter()
+    while not sim.ended:
+        sim.update()
+    wall = time.perf_counter() - start
+    shape = (replicas, len(sim.all_athletes))
+    return sim.times.reshape(shape), sim.ranks.reshape(shape), wall
+
+
+def compare(
+    reference: tuple[numpy.ndarray, numpy.ndarray],
+    result: tuple[numpy.ndarray, numpy.ndarray],
+) -> dict[str, float]:
+    """Differences of the mean finishing time and mean rank of each athlete against
+    the reference. The rank of an athlete changed when the means differ by more than
+    3 standard errors, or at all without random"""
+    ref_times, ref_ranks = reference
+    times, ranks = result
+    time_diff = times.mean(axis=0) - ref_times.mean(axis=0)
+    rank_diff = ranks.mean(axis=0) - ref_ranks.mean(axis=0)
+    error = numpy.zeros(ranks.shape[1])
+    if min(len(ranks), len(ref_ranks)) > 1:
+        error = numpy.sqrt(
+            ranks.var(axis=0, ddof=1) / len(ranks)
+            + ref_ranks.var(axis=0, ddof=1) / len(ref_ranks)
+        )
+    changed = numpy.abs(rank_diff) > numpy.maximum(3 * error, 1e-9)
+    return {
+        "time_bias": float(time_diff.mean()),
+        "time_max": float(numpy.abs(time_diff).max()),
+        "rank_max": float(numpy.abs(rank_diff).max()),
+        "changed": int(changed.sum()),
+    }
+
+
+if __name__ == "__main__":
+    path = ""
+    steps = DEFAULT_STEPS
+    reference = DEFAULT_REFERENCE
+    integrators = DEFAULT_INTEGRATORS
+    replicas = DEFAULT_REPLICAS
+    tolerance = simulation.Simulation.tolerance
+    seed = 0
+    use_random = True
+    output = ""
+    k = 1
+    while k < len(sys.argv):
+        arg = sys.argv[k]
+        if arg == "--steps":
+            k += 1
+            steps = [float(v) for v in sys.argv[k].split(",")]
+        elif arg == "--reference":
+            k += 1
+            reference = float(sys.argv[k])
+        elif arg == "--integrators":
+            k += 1
+            integrators = sys.argv[k].split(",")
+        elif arg == "--replicas":
+            k += 1
+            replicas = int(sys.argv[k])
+        elif arg == "--tolerance":
+            k += 1
+            tolerance = float(sys.argv[k])
+        elif arg == "--seed":
+            k += 1
+            seed = int(sys.argv[k])
+        elif arg == "--no-random":
+            use_random = False
+        elif arg == "--output":
+            k += 1
+            output = sys.argv[k]
+        elif (arg == "-h") or (arg == "--help"):
+            print("Help for convergence.py")
+            print("convergence.py RACE [options]")
+            print("Compare the finishing times and ranks of a race simulated with")
+            print("larger steps against a small step\n")
+            print("  --steps [float,...]   Steps to compare")
+            print(
+                "                        (default: " + ",".join(map(str, steps)) + ")"
+            )
+            print(
+                f"  --reference [float]   Step of the reference (default: {reference})"
+            )
+            print("  --integrators [str,...] euler and/or adaptive (default: both)")
+            print(f"  --replicas [int]      Replicas of the race (default: {replicas})")
+            print(
+                f"  --tolerance [float]   Of the adaptive integrator (default: {tolerance})"
+            )
+            print(f"  --seed [int]          (default: {seed})")
+            print("  --no-random           Without the random factor of the speed")
+            print("  --output [str]        Append the results to this file, as json")
+            exit(0)
+        elif path == "":
+            path = arg
+        else:
+            print(f"Unknow argument {arg}")
+            exit(1)
+        k += 1
+
+    if path == "":
+        print("Give the race to simulate, see -h")
+        exit(1)
+    for dt in [reference] + steps:
+        if not utils.divides_second(dt):
+            print(f"The step {dt} is not a number of milliseconds dividing a second")
+            exit(1)
+    if (replicas < 2) and use_random:
+        print("Use at least 2 replicas to compare the ranks")
+        exit(1)
+
+    ref = run_ensemble(path, reference, replicas, seed, use_random=use_random)
+    print(f"Reference: step {reference}, euler, {ref[2]:.2f}s")
+    print(
+        "  step integrator   wall   speedup  time bias  max |time|  max |rank|  changed"
+    )
+    results: list[dict] = []
+    for dt in steps:
+        for integrator in integrators:
+            out = run_ensemble(
+                path, dt, replicas, seed, integrator, tolerance, use_random
+            )
+            r = compare(ref[:2], out[:2])
+            results.append(dict(r, dt=dt, integrator=integrator, wall=out[2]))
+            print(
+                f"{dt:6} {integrator:10} {out[2]:6.2f}s {ref[2] / out[2]:8.1f}x "
+                f"{r['time_bias']:+9.3f}s {r['time_max']:10.3f}s "
+                f"{r['rank_max']:11.3f} {r['changed']:8}"
+            )
+
+    for integrator in integrators:
+        # Up to the first step that changes some ranks
+        kept = None
+        for r in sorted(results, key=lambda r: r["dt"]):
+            if r["integrator"] != integrator:
+                continue
+            if r["changed"] != 0:
+                break
+            kept = r
+        if kept is None:
+            print(f"{integrator}: all the steps change some ranks")
+        else:
+            # The wall time, as a coarser step is not always faster with adaptive
+            print(
+                f"{integrator}: the coarsest step keeping the ranks is {kept['dt']}, "
+                f"{kept['wall']:.2f}s"
+            )
+
+    if output != "":
+        with open(output, "a") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "race": os.path.basename(path),
+                        "reference": reference,
+                        "replicas": replicas,
+                        "tolerance": tolerance,
+                        "seed": seed,
+                        "use_random": use_random,
+                        "results": results,
+                    }
+                )
+                + "\n"
+            )
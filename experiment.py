@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+import simulation
+import utils
+
+ENGINES: dict[str, type[simulation.Simulation]] = {
+    "simple": simulation.SimpleSim,
+    "slipstream": simulation.SlipstreamSim,
+    "vector": simulation.VectorSim,
+    "event": simulation.EventSim,
+    "ensemble": simulation.EnsembleSim,
+}
+
+DEFAULT_OUTPUT = "runs.jsonl"
+# Settings that must be the same to resume a batch
+SETTINGS = ("race", "engine", "seed", "dt", "adaptive", "start")
+
+
+def start(
+    race: simulation.RaceContext,
+    engine: str = "slipstream",
+    seed: int | numpy.random.SeedSequence | None = None,
+    dt: float = 0.05,
+    adaptive: float | None = None,
+    start_mode: str = "pursuit",
+) -> simulation.Simulation:
+    """Create the simulation of a run, with its own athletes.
+    adaptive is the tolerance of the adaptive integrator, None to use euler.
+    start_mode is pursuit, wave or mass, see Simulation.set_start"""
+    sim = ENGINES[engine](dt, name=race.name, seed=seed)
+    if adaptive is not None:
+        sim.set_integrator("adaptive", adaptive)
+    sim.set_start(start_mode)
+    sim.load_context(race)
+    return sim
+
+
+def pool_size(runs: int) -> int:
+    """Number of processes, one per core this process can run on"""
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    return max(1, min(cores, runs))
+
+
+def run_seed(entropy: int, run: int) -> numpy.random.SeedSequence:
+    """Seed of a run, the same as SeedSequence(entropy).spawn(n)[run]"""
+    return numpy.random.SeedSequence(entropy, spawn_key=(run,))
+
+
+# Set in each worker by set_worker
+context: simulation.RaceContext | None = None
+settings: dict = {}
+
+
+def set_worker(race: simulation.RaceContext, header: dict) -> None:
+    """Initializer of the workers. The runs do not print their progress, the batch
+    shows its own"""
+    global context, settings
+    context = race
+    settings = header
+    sys.stdout = open(os.devnull, "w")
+
+
+def run_one(run: int) -> dict:
+    """Simulate a run, return its finishing order and rates"""
+    assert context is not None, "Use set_worker before run_one"
+    sim = start(
+        context,
+        settings["engine"],
+        run_seed(settings["seed"], run),
+        settings["dt"],
+        settings["adaptive"],
+        settings["start"],
+    )
+    if isinstance(sim, simulation.EventSim):
+        # Nothing is rendered, EventSim can jump over the seconds
+        sim.every_frame = False
+    sim.start()
+    while not sim.ended:
+        sim.update()
+    done = sorted(sim.done, key=lambda a: a.rank)
+    return {
+        "run": run,
+        "order": [a.name for a in done],
+        "ranks": [a.rank for a in done],
+        "expected": [a.expected_rank for a in done],
+        "times": [a.time for a in done],
+        "exact": list(sim.excat_rate()),
+        "adapted": list(sim.adapt_rate()),
+    }
+
+
+def write_results(name: str, run: dict) -> None:
+    """Append a run to name and points.csv, as Simulation.write and give_points do
+    for the runs outside of a batch"""
+    results = list(zip(run["order"], run["ranks"], run["expected"], run["times"]))
+    with open(name, "a") as f:
+        for athlete, rank, expected, time in results:
+            f.write(f"{athlete}, {rank}, {expected}, {time}\n")
+    with open("points.csv", "a") as f:
+        for athlete, rank, expected, _ in results:
+            sp = simulation.cup_points(rank)
+            rp = simulation.cup_points(expected)
+            f.write(f"{athlete}, {sp}, {rp}\n")
+
+
+def write_header(path: str, header: dict) -> None:
+    """Replace the header of a batch file, keeping its runs"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(path) as f, open(tmp, "w") as out:
+        f.readline()
+        out.write(json.dumps(header) + "\n")
+        for line in f:
+            out.write(line)
+    os.replace(tmp, path)
+
+
+def read_runs(path: str) -> tuple[dict | None, dict[int, dict]]:
+    """Header and runs of a batch file. A last line cut by an interruption is
+    removed from the file"""
+    if not os.path.exists(path):
+        return None, {}
+    with open(path, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            f.truncate(complete)
+    lines = data[:complete].decode().split("\n")[:-1]
+    if len(lines) == 0:
+        return None, {}
+    runs = {}
+    for line in lines[1:]:
+        r = json.loads(line)
+        runs[r["run"]] = r
+    return json.loads(lines[0]), runs
+
+
+def run_experiment(
+    race: simulation.RaceContext,
+    runs: int,
+    engine: str = "slipstream",
+    seed: int | None = None,
+    dt: float = 0.05,
+    adaptive: float | None = None,
+    start_mode: str = "pursuit",
+    output: str = DEFAULT_OUTPUT,
+    resume: bool = False,
+    jobs: int | None = None,
+) -> list[tuple[tuple[int, int, float], tuple[int, int, float]]]:
+    """Simulate 'runs' runs of the race on all the cores. Each run is written to
+    output (one json object per line, after a header with the settings) as soon as
+    it finishes. With resume, the runs already in output are not simulated again.
+    Each new run is also added to the files of Simulation.write and give_points.
+    Without resume, output must not exist.
+    Return excat_rate and adapt_rate of all the runs"""
+    if (not resume) and os.path.exists(output):
+        raise FileExistsError(f"{output} already exists, resume it or remove it")
+    header: dict = {
+        "race": race.path,
+        "engine": engine,
+        "seed": seed,
+        "dt": dt,
+        "adaptive": adaptive,
+        "start": start_mode,
+    }
+    previous, done = read_runs(output) if resume else (None, {})
+    if previous is not None:
+        if seed is None:
+            header["seed"] = previous["seed"]
+        changed = [k for k in SETTINGS if previous[k] != header[k]]
+        if len(changed) != 0:
+            raise ValueError(
+                f"Cannot resume {output}, it was run with other settings: "
+                + ", ".join(f"{k} {previous[k]} (not {header[k]})" for k in changed)
+            )
+        if previous["runs"] != runs:
+            write_header(output, dict(previous, runs=runs))
+    if header["seed"] is None:
+        header["seed"] = numpy.random.SeedSequence().entropy
+    header["runs"] = runs
+
+    todo = [r for r in range(runs) if r not in done]
+    print(f"Seed: {header['seed']}, {len(done)} runs already in {output}")
+    if len(todo) != 0:
+        with open(output, "w" if previous is None else "a") as f:
+            if previous is None:
+                f.write(json.dumps(header) + "\n")
+            workers = pool_size(len(todo)) if jobs is None else jobs
+            # Big enough to not wait on the pool, small enough to keep the
+            # workers busy until the end
+            chunk = max(1, min(64, len(todo) // (4 * workers)))
+            progress = utils.Progress(len(todo), "runs")
+            with multiprocessing.Pool(
+                workers, initializer=set_worker, initargs=(race, header)
+            ) as pool:
+                for r in pool.imap_unordered(run_one, todo, chunk):
+                    f.write(json.dumps(r) + "\n")
+                    f.flush()
+                    done[r["run"]] = r
+                    write_results(race.name, r)
+                    progress.update()
+            progress.finish()
+
+    return [
+        (tuple(done[r]["exact"]), tuple(done[r]["adapted"]))
+        for r in sorted(done)
+        if r < runs
+    ]
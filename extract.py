@@ -1,11 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import gzip
+import hashlib
+import json
+import multiprocessing
 import os
+import sys
+from typing import NotRequired, TypedDict
 
 import pypdf
 
 
+class ManifestEntry(TypedDict):
+    """What was extracted from a pdf, see read_manifest"""
+
+    hash: str
+    csv: str  # "" if the pdf has no record
+    pages: NotRequired[int]  # Not in the manifests written before the text cache
+
+
 def is_date(text: str) -> bool:
     """Return true if text is of the format '%d %s %d'"""
     date = text.count(" ") == 2
@@ -83,43 +97,240 @@ def get_distance(text: str) -> float:
     return 0
 
 
-def extract(path_file_in: str, dir_file_out: str) -> None:
-    """Use the other function in this file to extract all text from a pdf and write it to file having the name name as the pdf with _[distance] added at the end"""
-    print(f"Extracting {path_file_in} to {dir_file_out}")
-    os.makedirs(dir_file_out, exist_ok=True)
-    base = os.path.basename(path_file_in)
-    base = ".".join(base.split(".")[:-1])  # Remove last .* (extension)
-    pdf = pypdf.PdfReader(path_file_in)
+def list_pdfs(path: str) -> list[str]:
+    """Return all the pdfs under pdfs_dir/path, see csv_folder for their csv"""
+    path_current = os.path.join(pdfs_dir, path)
+    out = []
+    for pdf in sorted(os.listdir(path_current)):
+        pdf_path = os.path.join(path_current, pdf)
+        if ".pdf" == pdf[-4:]:
+            out.append(pdf_path)
+        if os.path.isdir(pdf_path):
+            out += list_pdfs(os.path.join(path, pdf))
+    return out
+
+
+def csv_folder(pdf_path: str) -> str:
+    """Folder of the csv of a pdf, the same folders as in pdfs_dir"""
+    folder = os.path.relpath(os.path.dirname(pdf_path), pdfs_dir)
+    return os.path.join(csv_dir, "" if folder == "." else folder)
+
+
+def write_records(
+    pdf_path: str, distance: float, records: list[dict[str, str]], old: str
+) -> str:
+    """Write the csv of a pdf and return its path, or "" if there is no record.
+    old is the csv written before for this pdf ("" if none), it is removed if the
+    name changed (with the distance) or if there is no record anymore"""
+    path_out = ""
+    if len(records) != 0:
+        base = os.path.basename(pdf_path)
+        base = ".".join(base.split(".")[:-1])  # Remove last .* (extension)
+        os.makedirs(csv_folder(pdf_path), exist_ok=True)
+        path_out = os.path.join(csv_folder(pdf_path), f"{base}_{distance}.csv")
+        write_to_csv(path_out, records)
+    same = (old != "") and (os.path.normpath(old) == os.path.normpath(path_out))
+    if (old != "") and (not same) and os.path.exists(old):
+        os.remove(old)
+    return path_out
+
+
+def hash_file(path_file: str) -> str:
+    """Hash of the content of a file"""
+    h = hashlib.sha256()
+    with open(path_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_manifest() -> dict[str, ManifestEntry]:
+    """Return the hash and csv written for each pdf already extracted"""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest: dict[str, ManifestEntry]) -> None:
+    os.makedirs(csv_dir, exist_ok=True)
+    tmp = f"{manifest_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_path)
+
+
+def text_path(h: str, page: int) -> str:
+    """Where the text of a page of the pdf with hash h is cached"""
+    return os.path.join(text_dir, h[:2], h, f"{page:04}.txt.gz")
+
+
+def read_page_text(h: str, page: int) -> str | None:
+    """Return the cached text of a page, or None if it was never extracted"""
+    path = text_path(h, page)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+def write_page_text(h: str, page: int, text: str) -> None:
+    path = text_path(h, page)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def extract_pages(
+    task: tuple[str, str, int, int],
+) -> tuple[str, int, float, list[dict[str, str]]]:
+    """Extract the records of the pages [first, last[ of a pdf of hash h.
+    The text of the pages is read from the cache, or extracted and cached.
+    Also return the distance if the first page is in the range (0 otherwise)"""
+    path_file_in, h, first, last = task
+    pdf = None
     records = []
-    distance = get_distance(pdf.get_page(0).extract_text())
-    for i in range(pdf.get_num_pages()):
-        page = pdf.get_page(i)
-        text = page.extract_text()
+    distance = 0.0
+    for i in range(first, last):
+        text = read_page_text(h, i)
+        if text is None:
+            if pdf is None:
+                pdf = pypdf.PdfReader(path_file_in)
+            text = pdf.get_page(i).extract_text()
+            write_page_text(h, i, text)
+        if i == 0:
+            distance = get_distance(text)
         records += convert_to_list(text)
-    os.makedirs(csv_dir, exist_ok=True)
-    path_out = os.path.join(dir_file_out, f"{base}_{distance}.csv")
-    write_to_csv(path_out, records)
+    return path_file_in, first, distance, records
 
 
-def extract_pdfs(path: str) -> None:
-    path_current = os.path.join(pdfs_dir, path)
-    l = os.listdir(path_current)
-    if len(l) == 0:
+def extract_all(jobs: int | None = None, force: bool = False) -> None:
+    """Extract all the pdfs that are new or changed since the last extraction.
+    Large pdfs are split in groups of pages so that they use all the processes"""
+    manifest = read_manifest()
+    todo: dict[str, str] = {}
+    for pdf_path in list_pdfs(""):
+        h = hash_file(pdf_path)
+        known = manifest.get(pdf_path)
+        if (
+            (not force)
+            and (known is not None)
+            and (known["hash"] == h)
+            # A pdf without any record has no csv
+            and ((known["csv"] == "") or os.path.exists(known["csv"]))
+        ):
+            continue
+        todo[pdf_path] = h
+    if len(todo) == 0:
+        print("Nothing to extract, all pdfs are up to date")
         return
 
-    for pdf in l:
-        pdf_path = os.path.join(path_current, pdf)
-        if ".pdf" == pdf[-4:]:
-            extract(pdf_path, os.path.join(csv_dir, path))
-        if os.path.isdir(pdf_path):
-            extract_pdfs(os.path.join(path, pdf))
+    tasks = []
+    pages: dict[str, int] = {}
+    for pdf_path in todo:
+        h = todo[pdf_path]
+        n = pypdf.PdfReader(pdf_path).get_num_pages()
+        pages[pdf_path] = n
+        for first in range(0, n, pages_per_task):
+            tasks.append((pdf_path, h, first, min(n, first + pages_per_task)))
+
+    # Write the csv of a pdf as soon as all its pages are extracted
+    parts: dict[str, dict[int, tuple[float, list[dict[str, str]]]]] = {
+        p: {} for p in todo
+    }
+    with multiprocessing.Pool(jobs) as pool:
+        for pdf_path, first, distance, records in pool.imap_unordered(
+            extract_pages, tasks
+        ):
+            parts[pdf_path][first] = (distance, records)
+            if len(parts[pdf_path]) * pages_per_task < pages[pdf_path]:
+                continue
+            chunks = parts.pop(pdf_path)
+            records = []
+            for k in sorted(chunks):
+                records += chunks[k][1]
+            old = manifest[pdf_path]["csv"] if pdf_path in manifest else ""
+            path_out = write_records(pdf_path, chunks[0][0], records, old)
+            # Also kept without any record, so that the pdf is not read again
+            manifest[pdf_path] = {
+                "hash": todo[pdf_path],
+                "csv": path_out,
+                "pages": pages[pdf_path],
+            }
+            write_manifest(manifest)
+            if path_out == "":
+                print(f"No record found in {pdf_path}")
+            else:
+                print(f"Extracted {pdf_path} to {path_out}")
+
+
+def reparse_all() -> None:
+    """Write all the csv again from the cached text of the pages, without reading
+    the pdfs. Used after changing convert_to_list"""
+    manifest = read_manifest()
+    for pdf_path, known in manifest.items():
+        n = known.get("pages")
+        texts: list[str] = []
+        if n is not None:
+            for i in range(n):
+                text = read_page_text(known["hash"], i)
+                if text is None:
+                    break
+                texts.append(text)
+        if (len(texts) == 0) or (len(texts) != n):
+            print(f"The text of {pdf_path} is not cached, extract it with -f")
+            continue
+
+        records = []
+        for text in texts:
+            records += convert_to_list(text)
+        # The distance (so the name) can change with the parser
+        distance = get_distance(texts[0])
+        known["csv"] = write_records(pdf_path, distance, records, known["csv"])
+        if known["csv"] == "":
+            print(f"No record found in {pdf_path}")
+    write_manifest(manifest)
 
 
 pdfs_dir = "pdf_results"
 csv_dir = "extracted"
+# Hidden, so that main.py does not list it as a race
+manifest_path = os.path.join(csv_dir, ".manifest.json")
+text_dir = os.path.join(csv_dir, ".text")
+pages_per_task = 4
 
 if __name__ == "__main__":
+    jobs = None
+    force = False
+    reparse = False
+    k = 1
+    while k < len(sys.argv):
+        arg = sys.argv[k]
+        if (arg == "-j") or (arg == "--jobs"):
+            k += 1
+            jobs = int(sys.argv[k])
+        elif (arg == "-f") or (arg == "--force"):
+            force = True
+        elif (arg == "-p") or (arg == "--reparse"):
+            reparse = True
+        elif (arg == "-h") or (arg == "--help"):
+            print("Help for extract.py")
+            print("Extract the results from the pdfs in pdf_results to extracted\n")
+            print("  -j/--jobs [int]   Number of processes (default: all cores)")
+            print("  -f/--force        Extract all pdfs, even the unchanged ones")
+            print("  -p/--reparse      Write the csv from the cached text of the pages")
+            print("                    (after changing the parser), pdfs are not read")
+            exit(0)
+        else:
+            print(f"Unknow argument {arg}")
+        k += 1
+
+    if reparse:
+        reparse_all()
+        exit(0)
     l = os.listdir(pdfs_dir)
     if len(l) == 0:
         print("No pdf found. Put them in the results folder so they can be extracted")
-    extract_pdfs("")
+    extract_all(jobs, force)
@@ -1,20 +1,30 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import multiprocessing
 import os
+import shutil
 import sys
 
 import matplotlib.pyplot as plt
+import numpy
 from matplotlib import animation
 from matplotlib.animation import FuncAnimation
 
+import experiment
+import render
+import season
 import simulation
+import store
 import utils
 
 
-def start(i: int | None = None, j: int | None = None) -> simulation.Simulation:
-    l = os.listdir("extracted")
+def race_context(
+    i: int | None = None, j: int | None = None, use_db: bool = False
+) -> simulation.RaceContext:
+    """Find the race, read it and the totals of the earlier races. Done once, the
+    runs share the result"""
+    # Hidden entries are not races (for example the cache, see cache.py)
+    l = [f for f in os.listdir("extracted") if f[0] != "."]
     if len(l) == 0:
         print("There is no data extracted. Please use extract.py")
         exit(1)
@@ -45,45 +55,63 @@ def start(i: int | None = None, j: int | None = None) -> simulation.Simulation:
     else:
         path = path_other
 
-    sim = simulation.SlipstreamSim(0.05, name=os.path.basename(path))
-    # sim = simulation.SimpleSim(0.05)
-    sim.load_csv(path)
-
-    if is_season:
-        num = int(os.path.basename(path).split(" ")[0])
-        l = os.listdir(path_other)
-        for race in l:
-            if int(race.split(" ")[0]) < num:
-                sim.prepare_race(os.path.join(path_other, race))
+    # Add the earlier races of the season, or the earlier years of the race
+    history = None
+    if use_db and (is_season or is_race):
+        conn = store.connect()
+        store.ingest(conn)
+        by = "number" if is_season else "date"
+        history = store.totals_before(conn, path, by)
+        conn.close()
+    elif is_season:
+        index = season.get_index(path_other, season.race_number)
+        history = index.totals_before(os.path.basename(path))
     elif is_race:
-        int_year, int_month, int_day = utils.extract_date(os.path.basename(path))
-
-        l = os.listdir(path_other)
-        for race in l:
-            year, month, day = utils.extract_date(race)
+        index = season.get_index(path_other, season.race_date)
+        history = index.totals_before(os.path.basename(path))
 
-            yes = False
-            yes = year < int_year
-            if not yes:
-                yes = month < int_month
-                if not yes:
-                    yes = day < int_day
-            if yes:
-                sim.prepare_race(os.path.join(path_other, race))
-
-    return sim
+    return simulation.RaceContext.from_csv(path, history)
 
 
 def run(
-    values: tuple[int | None, int | None, bool, int]
-) -> tuple[tuple[float, float, float], tuple[float, float, float]]:
-    i, j, render, s = values
-    if s is not None:
-        import time
-
-        time.sleep(s)
-    sim = start(i, j)
-    sim.render = render
+    race: simulation.RaceContext,
+    values: tuple[
+        bool,
+        numpy.random.SeedSequence | None,
+        str,
+        str,
+        str,
+        str | None,
+        str | None,
+        float,
+        float | None,
+        str,
+    ],
+) -> tuple[tuple[int, int, float], tuple[int, int, float]]:
+    (
+        do_render,
+        seed,
+        engine,
+        video,
+        time_video,
+        live,
+        profile,
+        dt,
+        adaptive,
+        start_mode,
+    ) = values
+    sim = experiment.start(race, engine, seed, dt, adaptive, start_mode)
+    sim.render = do_render
+    sim.video = video
+    if isinstance(sim, simulation.EventSim):
+        # The jumps only stop at every second for the rendering
+        sim.every_frame = (
+            do_render or (video != "") or (time_video != "") or (live is not None)
+        )
+    if live is not None:
+        sim.live = render.LiveRender(sim.max_place + 1, live)
+    if profile is not None:
+        sim.enable_profiler()
 
     sim.start()
     while not sim.ended:
@@ -97,14 +125,81 @@ def run(
     sim.give_points()
 
     sim.render_write()
+    if time_video != "":
+        render.TimeDistanceRender(sim, time_video).render_write()
+    if (sim.profiler is not None) and (profile is not None):
+        sim.profiler.show()
+        if profile != "":
+            sim.profiler.write(profile)
     return (sim.excat_rate(), sim.adapt_rate())
 
 
+def run_ensemble(
+    race: simulation.RaceContext,
+    replicas: int,
+    seed: int | numpy.random.SeedSequence | None = None,
+    dt: float = 0.05,
+    adaptive: float | None = None,
+    start_mode: str = "pursuit",
+) -> list[tuple[tuple[int, int, float], tuple[int, int, float]]]:
+    """Simulate all the replicas together, return the rates of each replica"""
+    sim = experiment.start(race, "ensemble", seed, dt, adaptive, start_mode)
+    assert isinstance(sim, simulation.EnsembleSim)
+    sim.replicas = replicas
+
+    sim.start()
+    while not sim.ended:
+        sim.update()
+
+    sim.write()
+    return sim.replica_rates()
+
+
+def show_rates(
+    out: list[tuple[tuple[int, int, float], tuple[int, int, float]]],
+) -> None:
+    correct_a = 0.0
+    correct_e = 0.0
+    total_a = 0.0
+    total_e = 0.0
+
+    for race in out:
+        e, a = race
+
+        correct_a += a[0]
+        total_a += a[1]
+        correct_e += e[0]
+        total_e += e[1]
+
+    print(
+        f"\nExact position: {correct_e} / {total_e} ({(correct_e / total_e * 100):6.5}%)"
+    )
+    print(
+        f"Adapted metric: {correct_a} / {total_a} = ({(correct_a / total_a * 100):6.5}%)"
+    )
+
+
 i = None
 j = None
 MULTI_DEFAULT = 10
 use_multi = -1
+ENSEMBLE_DEFAULT = 1000
+use_ensemble = -1
 use_render = False
+video = ""
+VIDEO_DEFAULT = "video.mp4"
+time_video = ""
+TIME_VIDEO_DEFAULT = "time_vs_distance.mp4"
+live = None
+profile = None
+seed = None
+dt = 0.05
+adaptive = None
+start_mode = "pursuit"
+engine = "slipstream"
+use_db = False
+output = experiment.DEFAULT_OUTPUT
+resume = False
 k = 0
 while k < len(sys.argv):
     arg = sys.argv[k]
@@ -123,8 +218,75 @@ while k < len(sys.argv):
             use_multi = MULTI_DEFAULT
         except IndexError:
             use_multi = MULTI_DEFAULT
+    elif (arg == "-k") or (arg == "--ensemble"):
+        try:
+            use_ensemble = int(sys.argv[k + 1])
+            k += 1
+        except ValueError:
+            use_ensemble = ENSEMBLE_DEFAULT
+        except IndexError:
+            use_ensemble = ENSEMBLE_DEFAULT
     elif (arg == "-r") or (arg == "--render"):
         use_render = True
+    elif (arg == "-v") or (arg == "--video"):
+        use_render = True
+        if (k + 1 < len(sys.argv)) and (sys.argv[k + 1][0] != "-"):
+            video = sys.argv[k + 1]
+            k += 1
+        else:
+            video = VIDEO_DEFAULT
+    elif (arg == "-t") or (arg == "--time-distance"):
+        if (k + 1 < len(sys.argv)) and (sys.argv[k + 1][0] != "-"):
+            time_video = sys.argv[k + 1]
+            k += 1
+        else:
+            time_video = TIME_VIDEO_DEFAULT
+    elif (arg == "-l") or (arg == "--live"):
+        if (k + 1 < len(sys.argv)) and (sys.argv[k + 1][0] != "-"):
+            live = sys.argv[k + 1]
+            k += 1
+        else:
+            live = ""
+    elif (arg == "-p") or (arg == "--profile"):
+        if (k + 1 < len(sys.argv)) and (sys.argv[k + 1][0] != "-"):
+            profile = sys.argv[k + 1]
+            k += 1
+        else:
+            profile = ""
+    elif (arg == "-s") or (arg == "--seed"):
+        k += 1
+        seed = int(sys.argv[k])
+    elif arg == "--dt":
+        k += 1
+        dt = float(sys.argv[k])
+    elif arg == "--adaptive":
+        try:
+            adaptive = float(sys.argv[k + 1])
+            k += 1
+        except ValueError:
+            adaptive = simulation.Simulation.tolerance
+        except IndexError:
+            adaptive = simulation.Simulation.tolerance
+    elif arg == "--start":
+        k += 1
+        start_mode = sys.argv[k]
+        if start_mode not in simulation.Simulation.start_modes:
+            print(f"Unknow start {start_mode}, choose from pursuit, wave or mass")
+            exit(1)
+    elif (arg == "-o") or (arg == "--output"):
+        k += 1
+        output = sys.argv[k]
+    elif arg == "--resume":
+        resume = True
+    elif (arg == "-d") or (arg == "--db"):
+        use_db = True
+    elif (arg == "-e") or (arg == "--engine"):
+        k += 1
+        engine = sys.argv[k]
+        if engine not in experiment.ENGINES:
+            engines = ", ".join(experiment.ENGINES)
+            print(f"Unknow engine {engine}, choose from {engines}")
+            exit(1)
     elif arg[-7:] == "main.py":
         pass
     elif (arg == "-h") or (arg == "--help"):
@@ -136,40 +298,101 @@ while k < len(sys.argv):
         print("                    Use the same number as shown when not using -i")
         print("  -j [int]          Select the race in season or year in race")
         print("                    Use the same number as shown when not using -j")
-        print("  -m/--multi [int]  Select the number same run to do")
+        print("  -m/--multi [int]  Select the number same run to do, on all the cores")
+        print("  -o/--output [str] File of the runs of -m, one json line per run")
+        print(f"                    (default: {experiment.DEFAULT_OUTPUT})")
+        print("  --resume          Only do the runs of -m missing from the output")
+        print("  -k/--ensemble [int]  Number of runs to simulate together in arrays")
         print("  -r/--render       If set, write all images of the simulation")
+        print("  -v/--video [str]  Render directly to a video (default: video.mp4),")
+        print("                    needs ffmpeg")
+        print("  -t/--time-distance [str]  Render the distance against time in a video")
+        print("                    (default: time_vs_distance.mp4), needs ffmpeg")
+        print("  -l/--live [str]   Show the race while it is simulated, or encode it")
+        print("                    in this video. Frames are dropped if it is too slow")
+        print("  -p/--profile [str] Show the time spent in each phase of the runs,")
+        print("                    and append it as json to this file if given")
+        print(
+            "  -s/--seed [int]   Seed of the random numbers, to run the same races again"
+        )
+        print("  --dt [float]      Step of the simulation in seconds (default: 0.05)")
+        print(
+            "  --adaptive [float] Vector simulations: refine the steps of the athletes"
+        )
+        print(
+            "                    near a threshold, with this tolerance (default: 1e-4)"
+        )
+        print("                    Less biased than euler at the same step, but slower")
+        print("                    than euler at a smaller step keeping the same ranks")
+        print("                    See convergence.py to choose the step")
+        print("  --start [str]     pursuit (default, the time behind the best jump),")
+        print("                    wave (groups of 10 every 30s) or mass (all at once)")
+        print("  -d/--db           Read the earlier races from the database (store.py)")
+        print("  -e/--engine [str] Simulation to use: simple, slipstream (default)")
+        print("                    or vector (slipstream, whole field in one step)")
+        print("                    or event (vector without the random factors,")
+        print("                    athletes alone jump ahead)")
     else:
         print(f"Unknow argument {arg}")
 
     k += 1
 
-if use_multi == -1:
-    for _ in range(50):
-        run((i, j, use_render, None))
-else:
-    correct_a = 0.0
-    correct_e = 0.0
-    total_a = 0.0
-    total_e = 0.0
-
-    points = {}
-
-    pool = multiprocessing.Pool(12)
-    out = pool.map(run, [(i, j, use_render, k % 12) for k in range(use_multi)])
-    for race in out:
-        e, a = race
+if (live is not None) and (use_render or (time_video != "") or (use_multi != -1)):
+    print("-l/--live keeps no frames, it cannot be used with -r, -v, -t or -m")
+    exit(1)
+if (live is not None) and (live != "") and (shutil.which(render.ffmpeg) is None):
+    print(f"Could not find {render.ffmpeg}, -l/--live cannot encode {live}")
+    exit(1)
+if (use_multi != -1) and (use_ensemble == -1):
+    if use_render or (time_video != "") or (profile is not None):
+        print("-m only writes the runs to the output, it cannot be used with -r, -v,")
+        print("-t or -p")
+        exit(1)
+    if (not resume) and os.path.exists(output):
+        print(f"{output} already exists, use --resume to add runs to it")
+        exit(1)
 
-        correct_a += a[0]
-        total_a += a[1]
-        correct_e += e[0]
-        total_e += e[1]
+if not utils.divides_second(dt):
+    print(f"The step {dt} is not a number of milliseconds dividing a second")
+    exit(1)
+# -k always uses the ensemble engine
+if (adaptive is not None) and (use_ensemble == -1):
+    if "adaptive" not in experiment.ENGINES[engine].integrators:
+        print(f"--adaptive needs the vector, event or ensemble engine, not {engine}")
+        exit(1)
 
-    print(
-        f"\nExact position: {correct_e} / {total_e} ({(correct_e / total_e * 100):6.5}%)"
-    )
-    print(
-        f"Adapted metric: {correct_a} / {total_a} = ({(correct_a / total_a * 100):6.5}%)"
+# Read once, the runs only create their athletes
+race = race_context(i, j, use_db)
+if (use_multi != -1) and (use_ensemble == -1):
+    show_rates(
+        experiment.run_experiment(
+            race, use_multi, engine, seed, dt, adaptive, start_mode, output, resume
+        )
     )
+    exit(0)
+
+# Each run gets its own stream, derived from the seed
+root = numpy.random.SeedSequence(seed)
+print(f"Seed: {root.entropy}")
+if use_ensemble != -1:
+    show_rates(run_ensemble(race, use_ensemble, root, dt, adaptive, start_mode))
+else:
+    for s in root.spawn(50):
+        run(
+            race,
+            (
+                use_render,
+                s,
+                engine,
+                video,
+                time_video,
+                live,
+                profile,
+                dt,
+                adaptive,
+                start_mode,
+            ),
+        )
 
-# ffmpeg command:
+# ffmpeg command (when not using -v):
 # ffmpeg -i imgs/%5d.png video.mp4
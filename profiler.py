@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+from typing import Any, Callable
+
+# Phase -> method of the simulation timed for it
+PHASES = {
+    "update": "update",
+    "start_update": "start_update",
+    "slipstream": "find_leaders",
+    "rank": "update_rank",
+    "render": "render_update_data",
+    "write": "write",
+    "points": "give_points",
+    "render_write": "render_write",
+}
+# Phases called by update, the rest of update is the time spent on the athletes
+IN_UPDATE = ("start_update", "slipstream", "rank", "render")
+
+
+class Profiler:
+    """Wall time and number of calls of each phase of a simulation.
+    The methods are only wrapped on the instance given to attach, so a simulation
+    without profiler runs the original methods and pays nothing."""
+
+    def __init__(self) -> None:
+        self.times = {phase: 0.0 for phase in PHASES}
+        self.calls = {phase: 0 for phase in PHASES}
+        # Sum over the steps of the number of athletes skiing
+        self.athletes = 0
+        self.started = time.perf_counter()
+        self.sim: Any = None
+
+    def attach(self, sim: Any) -> None:
+        """Time the phases of sim (a simulation.Simulation)"""
+        self.sim = sim
+        for phase, method in PHASES.items():
+            if hasattr(sim, method):
+                setattr(sim, method, self.timed(phase, getattr(sim, method)))
+
+    def timed(self, phase: str, function: Callable) -> Callable:
+        """Return function, adding its time to the phase"""
+        times = self.times
+        calls = self.calls
+
+        def timed_function(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            out = function(*args, **kwargs)
+            times[phase] += time.perf_counter() - start
+            calls[phase] += 1
+            if phase == "update":
+                self.athletes += self.sim.num_skiing()
+            return out
+
+        return timed_function
+
+    def history(self) -> dict[str, int]:
+        """Size of what the simulation keeps during the race. It only grows, so this
+        is the peak at the end"""
+        sim = self.sim
+        recorder = getattr(sim, "recorder", None)
+        return {
+            "frames": sim.num_frames,
+            "frames_bytes": sim.frames.nbytes,
+            "overtakes": len(getattr(sim, "overtakes", [])),
+            "recorder_bytes": (
+                0 if recorder is None else sum(d.nbytes for d in recorder.data.values())
+            ),
+        }
+
+    def report(self) -> dict[str, Any]:
+        """All the measures, as written by self.write"""
+        steps = self.calls["update"]
+        phases = {
+            phase: {"time": self.times[phase], "calls": self.calls[phase]}
+            for phase in PHASES
+            if self.calls[phase] != 0
+        }
+        athletes = self.times["update"] - sum(self.times[p] for p in IN_UPDATE)
+        phases["athletes"] = {"time": athletes, "calls": steps}
+        return {
+            "name": self.sim.name,
+            "engine": type(self.sim).__name__,
+            "dt": self.sim.dt,
+            "wall": time.perf_counter() - self.started,
+            "steps": steps,
+            "steps_per_second": steps / max(self.times["update"], 1e-9),
+            "athletes_per_step": self.athletes / max(steps, 1),
+            "phases": phases,
+            "history": self.history(),
+        }
+
+    def show(self) -> None:
+        report = self.report()
+        print(
+            f"\n{report['engine']} on {report['name']}: {report['steps']} steps "
+            f"in {report['wall']:.3f}s, {report['steps_per_second']:.1f} steps/s, "
+            f"{report['athletes_per_step']:.1f} athletes/step"
+        )
+        total = max(self.times["update"], 1e-9)
+        for phase, p in report["phases"].items():
+            per_call = p["time"] / max(p["calls"], 1) * 1e6
+            share = ""
+            if (phase == "athletes") or (phase in IN_UPDATE):
+                share = f" ({p['time'] / total * 100:5.1f}% of update)"
+            print(
+                f"  {phase:13}{p['time']:10.4f}s {p['calls']:8} calls "
+                f"{per_call:10.1f}us/call{share}"
+            )
+        print(
+            "  history: " + ", ".join(f"{k} {v}" for k, v in report["history"].items())
+        )
+
+    def write(self, path: str) -> None:
+        """Append the report to path, one json object per line"""
+        with open(path, "a") as f:
+            f.write(json.dumps(self.report()) + "\n")
@@ -3,18 +3,190 @@
 
 import multiprocessing
 import os
+import queue
 import shutil
+import subprocess
+import tempfile
+from multiprocessing import shared_memory
+from typing import Callable, override
 
 import matplotlib.pyplot as plt
+import numpy
 from labellines import labelLines
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 
 import athlete
+import utils
+
+# Can be replaced by the full path of the executable
+ffmpeg = "ffmpeg"
+
+# Set in each render worker by attach_frames: the frames and the frame rate. The
+# video can be longer than the frames, the last frame is repeated at the end
+worker_memory: shared_memory.SharedMemory | None = None
+worker_frames = numpy.empty((0, 0, 3), dtype=numpy.float32)
+worker_fps = 25
+
+
+def attach_frames(name: str, shape: tuple[int, int, int], fps: int) -> None:
+    """Initializer of the render workers: map the frames shared by the parent"""
+    global worker_memory, worker_frames, worker_fps
+    worker_memory = shared_memory.SharedMemory(name=name)
+    worker_frames = numpy.ndarray(shape, dtype=numpy.float32, buffer=worker_memory.buf)
+    worker_fps = fps
+
+
+def frame_data(frame: int) -> numpy.ndarray:
+    """(rank, start, distance) of each starting place in a frame of the video, NaN
+    when the athlete is not in the frame"""
+    return worker_frames[min(frame, len(worker_frames) - 1)]
+
+
+def open_ffmpeg(canvas: FigureCanvasAgg, fps: int, path: str) -> subprocess.Popen:
+    """Start an ffmpeg process encoding the pixels of canvas written to its stdin"""
+    width, height = canvas.get_width_height()
+    command = [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo"]
+    command += ["-pix_fmt", "rgba", "-s", f"{width}x{height}"]
+    command += ["-r", str(fps), "-i", "-", "-pix_fmt", "yuv420p", path]
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+
+def close_ffmpeg(process: subprocess.Popen, path: str) -> None:
+    """Wait for ffmpeg to finish writing the video"""
+    assert process.stdin is not None, "Use open_ffmpeg to start the process"
+    process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg could not encode {path}")
+
+
+class DistanceFigure:
+    """The line of each athlete at their starting place, from the start of the
+    window to their distance. The artists are created once, and only moved for
+    each frame"""
+
+    def __init__(self, fig: Figure, places: int) -> None:
+        self.ax = fig.add_subplot()
+        self.ax.set_xlabel(f"Distance (in m)")
+        self.ax.set_ylabel("Starting position")
+        self.ax.set_ylim((0, places))
+        self.ax.invert_yaxis()
+        # One line and one label per starting place, hidden when not in the frame
+        self.lines = []
+        self.labels = []
+        for p in range(places):
+            c = SimuRender.colors[(p - 1) % len(SimuRender.colors)]
+            self.lines.append(self.ax.plot([], [], color=c)[0])
+            self.labels.append(
+                self.ax.text(0, p, "", color=c, ha="center", va="center", clip_on=True)
+            )
+            self.labels[p].set_bbox({"facecolor": "white", "edgecolor": "none"})
+
+    def update(self, data: numpy.ndarray) -> None:
+        """Move the artists to the frame data (see SimuRender.frames)"""
+        present = ~numpy.isnan(data[:, 2])
+        for p in range(len(self.lines)):
+            self.lines[p].set_visible(present[p])
+            self.labels[p].set_visible(present[p])
+        for p in numpy.flatnonzero(present).tolist():
+            rank, start, end = data[p]
+            self.lines[p].set_data([start, end], [p, p])
+            d = abs(end - start)
+            self.labels[p].set_x(start + d / 2 * (1 + 0.2 * ((p % 3) - 1)))
+            self.labels[p].set_text(f"{int(rank)}")
+        if present.any():
+            # Same limits as the autoscale of SimuRender.save_frame
+            x_min = data[present, 1].min()
+            x_max = data[present, 2].max()
+            margin = max(0.05 * (x_max - x_min), 0.5)
+            self.ax.set_xlim((x_min - margin, x_max + margin))
+
+
+def live_worker(
+    frames: multiprocessing.Queue, places: int, video: str, fps: int
+) -> None:
+    """Show the frames received from LiveRender in a window, or encode them in
+    video if set, until None is received"""
+    if video == "":
+        fig = plt.figure(figsize=(15, 5))
+        plot = DistanceFigure(fig, places)
+        fig.canvas.draw()
+        while True:
+            data = frames.get()
+            if data is None:
+                break
+            plot.update(data)
+            fig.canvas.draw_idle()
+            plt.pause(0.001)
+        plt.close(fig)
+        return
+    fig = Figure(figsize=(15, 5))
+    canvas = FigureCanvasAgg(fig)
+    plot = DistanceFigure(fig, places)
+    canvas.draw()
+    process = open_ffmpeg(canvas, fps, video)
+    assert process.stdin is not None
+    while True:
+        data = frames.get()
+        if data is None:
+            break
+        plot.update(data)
+        canvas.draw()
+        process.stdin.write(canvas.buffer_rgba())
+    close_ffmpeg(process, video)
+
+
+class LiveRender:
+    """Send the frames to another process while the simulation runs, to show or
+    encode them (see live_worker). The queue is bounded: when the other process is
+    too slow, the frames are dropped and the simulation never waits"""
+
+    def __init__(self, places: int, video: str = "", fps: int = 25, size: int = 8):
+        if (video != "") and (shutil.which(ffmpeg) is None):
+            raise FileNotFoundError(f"Could not find {ffmpeg} to encode {video}")
+        self.queue: multiprocessing.Queue = multiprocessing.Queue(size)
+        self.process = multiprocessing.Process(
+            target=live_worker, args=(self.queue, places, video, fps)
+        )
+        self.process.start()
+        self.sent = 0
+        self.dropped = 0
+
+    def push(self, data: numpy.ndarray) -> None:
+        """Send a frame, or drop it if the queue is full or the other process
+        stopped"""
+        if not self.process.is_alive():
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(data)
+            self.sent += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Wait for the other process to handle the frames sent"""
+        # The queue is only emptied while the other process runs
+        while self.process.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                break
+            except queue.Full:
+                pass
+        self.process.join()
+        print(f"Live render: {self.sent} frames sent, {self.dropped} dropped")
+        if self.process.exitcode != 0:
+            # What is left in the queue will never be read
+            self.queue.cancel_join_thread()
+            print(f"The live render stopped with the code {self.process.exitcode}")
 
 
 class SimuRender:
     # Used in functions here, but changed in athlete.Athlete
     ended = False
-    waiting: dict[float, list[athlete.Athlete]] = {}
+    # Heap of (start in ms, index, athlete), see Simulation.start
+    waiting: list[tuple[int, int, athlete.Athlete]] = []
     skiing: list[athlete.Athlete] = []
     done: list[athlete.Athlete] = []
 
@@ -23,54 +195,155 @@ class SimuRender:
     max_place: int = -1
     render = False
     colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    # Number of frames the last frame is shown for at the end
+    end_hold = 250
 
     # File used
     name = ""
+    # If set, render_write encodes this video instead of writing the images
+    video = ""
+    fps = 25
+    # Maximum number of frames encoded by a worker at once
+    chunk_frames = 250
 
     # Rendering records
     time: dict[str, list[float]] = {}
     dist: dict[str, list[float]] = {}
-    frames: dict[int, dict[int, tuple[int, float, float]]] = {}
+    # frames[k, p] is (rank, start of the window, distance) of the athlete at the
+    # starting place p at the second k + 1, NaN if they are not skiing or done
+    frames = numpy.empty((0, 0, 3), dtype=numpy.float32)
+    num_frames = 0
+    # Number of times the last frame is shown
+    hold = 1
+    # If set, the frames are sent to it and not kept
+    live: LiveRender | None = None
+
+    def start_frames(self, size: int) -> None:
+        """Allocate the frames for 'size' seconds, grown when full"""
+        if self.live is not None:
+            size = 1
+        self.frames = numpy.full(
+            (max(size, 1), self.max_place + 1, 3), numpy.nan, dtype=numpy.float32
+        )
+        self.num_frames = 0
+        self.hold = 1
 
-    def render_save_frame(self, frame: int) -> None:
-        """Save the frame on disk. Written to be used via multiprocessing"""
+    @staticmethod
+    def save_frame(frame: int) -> int:
+        """Save the frame on disk. Written to be used via multiprocessing.
+        Return the number of frames written"""
+        data = frame_data(frame)
         fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(15, 5))
         ax.set_xlabel(f"Distance (in m)")
         ax.set_ylabel("Starting position")
-        ax.set_ylim([0, self.max_place + 1])
+        ax.set_ylim([0, len(data)])
         ax.invert_yaxis()
         xvals = []
-        for p in self.frames[frame]:
-            c = self.colors[(p - 1) % len(self.colors)]
-            data = self.frames[frame][p]
-            ax.plot(data[1:], [p, p], color=c, label=f"{data[0]}")
-            d = abs(data[2] - data[1])
-            x = data[1] + d / 2 * (1 + 0.2 * ((p % 3) - 1))
-            if (x < data[1]) or (x > data[2]):
-                print(data[1], data[2], p)
+        for p in numpy.flatnonzero(~numpy.isnan(data[:, 2])):
+            c = SimuRender.colors[(p - 1) % len(SimuRender.colors)]
+            rank, start, end = data[p]
+            ax.plot([start, end], [p, p], color=c, label=f"{int(rank)}")
+            d = abs(end - start)
+            x = start + d / 2 * (1 + 0.2 * ((p % 3) - 1))
+            if (x < start) or (x > end):
+                print(start, end, p)
             xvals.append(x)
         labelLines(ax.get_lines(), xvals=xvals)
-        fig.savefig(os.path.join("imgs", f"{frame:05}.png"))
+        fig.savefig(os.path.join("imgs", f"{frame + 1:05}.png"))
         plt.close(fig)
-        print(
-            f"{len(os.listdir('imgs'))/len(self.frames)*100:4.4}% is done  ", end="\r"
-        )
+        return 1
+
+    @staticmethod
+    def encode_frames(task: tuple[int, int, str]) -> int:
+        """Encode the frames first to last - 1 in a video. Written to be used via
+        multiprocessing. One figure is drawn for all frames, only the lines and
+        labels are moved, and the pixels are sent to ffmpeg without touching disk.
+        Return the number of frames encoded"""
+        first, last, path = task
+        fig = Figure(figsize=(15, 5))
+        canvas = FigureCanvasAgg(fig)
+        plot = DistanceFigure(fig, worker_frames.shape[1])
+        canvas.draw()
+        process = open_ffmpeg(canvas, worker_fps, path)
+        assert process.stdin is not None
+        for frame in range(first, last):
+            plot.update(frame_data(frame))
+            canvas.draw()
+            process.stdin.write(canvas.buffer_rgba())
+        close_ffmpeg(process, path)
+        return last - first
+
+    def render_pool(
+        self, function: Callable, tasks: list, workers: int | None = None
+    ) -> None:
+        """Run function on the tasks in a pool of workers. The frames are put in
+        shared memory, so the workers read them without any copy. function returns
+        the number of frames done, to show the progress"""
+        frames = self.frames[: self.num_frames]
+        memory = shared_memory.SharedMemory(create=True, size=max(frames.nbytes, 1))
+        try:
+            shared = numpy.ndarray(frames.shape, frames.dtype, buffer=memory.buf)
+            shared[:] = frames
+            del shared
+            total = self.num_frames + self.hold - 1
+            args = (memory.name, frames.shape, self.fps)
+            progress = utils.Progress(total)
+            with multiprocessing.Pool(workers, attach_frames, args) as pool:
+                for done in pool.imap_unordered(function, tasks):
+                    progress.update(done)
+            progress.finish()
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def render_write_video(self) -> None:
+        """Encode contiguous chunks of frames in parallel, then join them in
+        self.video"""
+        if shutil.which(ffmpeg) is None:
+            print(f"Could not find {ffmpeg}, the video is not written")
+            return
+        path = os.path.abspath(self.video)
+        num = self.num_frames + self.hold - 1
+        workers = min(os.cpu_count() or 1, num)
+        # Small chunks, so that the progress is updated often enough
+        size = min(-(-num // workers), self.chunk_frames)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(path)) as tmp:
+            tasks = []
+            for first in range(0, num, size):
+                last = min(first + size, num)
+                tasks.append((first, last, os.path.join(tmp, f"{first:05}.mp4")))
+            self.render_pool(type(self).encode_frames, tasks, workers)
+
+            parts = os.path.join(tmp, "parts.txt")
+            with open(parts, "w") as f:
+                for _, _, part in tasks:
+                    f.write(f"file '{part}'\n")
+            command = [ffmpeg, "-y", "-loglevel", "error", "-f", "concat"]
+            command += ["-safe", "0", "-i", parts, "-c", "copy", path]
+            subprocess.run(command, check=True)
 
     def render_write(self) -> None:
         """Create a multiprocessing pool to write all frames to disk"""
+        if self.live is not None:
+            self.live.close()
+            self.live = None
+            return
         if not self.render:
             return
-        pool = multiprocessing.Pool()
-        shutil.rmtree("imgs")
+        if self.video != "":
+            self.render_write_video()
+            return
+        shutil.rmtree("imgs", ignore_errors=True)
         os.makedirs("imgs", exist_ok=True)
-        pool.map(self.render_save_frame, range(1, len(self.frames) + 1))
+        num = self.num_frames + self.hold - 1
+        self.render_pool(type(self).save_frame, list(range(num)))
 
     def render_update_data(self) -> None:
         """Update the data used in rendering"""
         # Get all athletes
         all_athlete = []
-        for l in self.waiting:
-            all_athlete += self.waiting[l]
+        for _, _, a in self.waiting:
+            all_athlete.append(a)
         all_athlete += self.skiing.copy() + self.done.copy()
 
         # Keep the plotted window around the the min and max without a big zoom out
@@ -80,22 +353,122 @@ class SimuRender:
         else:
             m = 0
 
+        self.render_add_data(m)
         if self.ended:
             # Fix the render for some time at the end
-            for i in range(250):
-                self.render_add_data(m)
-                self.frame += 1
-        else:
-            self.render_add_data(m)
+            self.hold = self.end_hold
 
     def render_add_data(self, m: float) -> None:
-        # There can not be* more than one athlete with a starting place, and they cannot be in self.skiing an self.done at the same time
-        self.frames[self.frame] = {}
-        for a in self.skiing.copy() + self.done.copy():
-            self.frames[self.frame][a.starting_place] = (
-                a.rank,
-                m,
-                a.distance,
+        row = self.frame - 1
+        if self.live is not None:
+            # Nothing is kept, the frame is written in a new array and sent
+            row = 0
+            self.frames = numpy.empty((1,) + self.frames.shape[1:], numpy.float32)
+        elif row >= len(self.frames):
+            frames = numpy.full(
+                (2 * row + 1,) + self.frames.shape[1:], numpy.nan, dtype=numpy.float32
             )
+            frames[: len(self.frames)] = self.frames
+            self.frames = frames
+        # There can not be* more than one athlete with a starting place, and they cannot be in self.skiing an self.done at the same time
+        athletes = self.skiing + self.done
+        places = [a.starting_place for a in athletes]
+        data = self.frames[row]
+        data[:] = numpy.nan
+        data[places, 0] = [a.rank for a in athletes]
+        data[places, 1] = m
+        data[places, 2] = [a.distance for a in athletes]
+        if self.live is not None:
+            self.live.push(data)
+            return
+        self.num_frames = row + 1
         # self.time[a.name][self.frame] = [0, a.time]
         # self.dist[a.name][self.frame] = [a.starting_place, a.starting_place]
+
+
+class TimeDistanceRender(SimuRender):
+    """Video of the distance of each athlete against the time, from the frames of a
+    simulation. The axes are fixed, so each frame only draws the segments since the
+    previous frame on top of the image of the previous frame (blitting). The time
+    to render is linear in the number of frames, whatever the length of the race."""
+
+    def __init__(self, sim: SimuRender, video: str = "time_vs_distance.mp4") -> None:
+        self.frames = sim.frames
+        self.num_frames = sim.num_frames
+        self.hold = sim.hold
+        self.max_place = sim.max_place
+        self.name = sim.name
+        self.render = True
+        self.video = video
+
+    @staticmethod
+    def segments(p: int, first: int, last: int) -> numpy.ndarray:
+        """Segments of the athlete at starting place p between the frames first - 1
+        and last - 1, as (time, distance). Nothing is drawn before the start and
+        after the finish"""
+        first = max(first, 1)
+        last = min(last, len(worker_frames))
+        d = worker_frames[first - 1 : last, p, 2]
+        t = numpy.arange(first, last + 1, dtype=numpy.float32)
+        keep = ~numpy.isnan(d[:-1]) & ~numpy.isnan(d[1:]) & (d[:-1] != d[1:])
+        starts = numpy.stack((t[:-1], d[:-1]), axis=1)[keep]
+        ends = numpy.stack((t[1:], d[1:]), axis=1)[keep]
+        return numpy.stack((starts, ends), axis=1)
+
+    @staticmethod
+    @override
+    def encode_frames(task: tuple[int, int, str]) -> int:
+        first, last, path = task
+        places = worker_frames.shape[1]
+        distance = numpy.nanmax(worker_frames[:, :, 2], initial=0)
+
+        fig = Figure(figsize=(15, 5))
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.set_xlabel("Time (in s)")
+        ax.set_ylabel("Distance (in m)")
+        # The frames repeated at the end do not move the lines
+        ax.set_xlim((0, len(worker_frames) + 1))
+        ax.set_ylim((0, float(distance) * 1.02 + 1))
+        # One collection per athlete, with everything before the chunk at first, then
+        # only the last segment
+        lines = []
+        labels = []
+        for p in range(places):
+            c = SimuRender.colors[(p - 1) % len(SimuRender.colors)]
+            lines.append(LineCollection(list(TimeDistanceRender.segments(p, 1, first))))
+            lines[p].set_color(c)
+            ax.add_collection(lines[p])
+            # Clipped, as only the inside of the axes is restored
+            labels.append(ax.text(0, 0, "", color=c, va="center", clip_on=True))
+            labels[p].set_animated(True)
+        canvas.draw()
+        for p in range(places):
+            lines[p].set_animated(True)
+        background = canvas.copy_from_bbox(ax.bbox)
+
+        process = open_ffmpeg(canvas, worker_fps, path)
+        assert process.stdin is not None
+        for frame in range(first, last):
+            canvas.restore_region(background)
+            data = frame_data(frame)
+            moving = numpy.zeros(0, dtype=int)
+            if (frame != 0) and (frame < len(worker_frames)):
+                before = worker_frames[frame - 1, :, 2]
+                moving = numpy.flatnonzero(
+                    ~numpy.isnan(before)
+                    & ~numpy.isnan(data[:, 2])
+                    & (before != data[:, 2])
+                )
+            for p in moving:
+                lines[p].set_segments([[(frame, before[p]), (frame + 1, data[p, 2])]])
+                ax.draw_artist(lines[p])
+            # The lines stay for the next frames, the labels do not
+            background = canvas.copy_from_bbox(ax.bbox)
+            for p in moving:
+                labels[p].set_position((frame + 1, data[p, 2]))
+                labels[p].set_text(f" {int(data[p, 0])}")
+                ax.draw_artist(labels[p])
+            process.stdin.write(canvas.buffer_rgba())
+        close_ffmpeg(process, path)
+        return last - first
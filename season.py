@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import json
+import os
+from typing import Any, Callable
+
+import cache
+import utils
+
+
+def race_number(file: str) -> int:
+    """Order of the races in a season: the number at the start of the file name"""
+    return int(file.split(" ")[0])
+
+
+def race_date(file: str) -> tuple[int, int, int]:
+    """Order of the races in a race folder (all the years of a race): the date"""
+    return utils.extract_date(file)
+
+
+class SeasonIndex:
+    """Cumulative cross country distance and time of each athlete over the races of
+    a folder (a season, or all the years of a race), in the order given by key.
+    The totals of each race are saved in the cache folder, and only the races that
+    are new or were modified are read again."""
+
+    def __init__(self, directory: str, key: Callable[[str], Any]) -> None:
+        self.directory = directory
+        self.key = key
+        name = f"season-{cache.cache_key(directory)}.json"
+        self.path = os.path.join(cache.cache_dir, name)
+        # File name -> (modification time, {athlete: (distance, time)})
+        self.races: dict[str, tuple[int, dict[str, tuple[float, float]]]] = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.races = {
+                    r: (m, {a: (d, t) for a, (d, t) in totals.items()})
+                    for r, (m, totals) in json.load(f).items()
+                }
+        self.refresh()
+
+    def race_totals(self, file: str) -> dict[str, tuple[float, float]]:
+        """Distance and time of each athlete in a single race"""
+        path = os.path.join(self.directory, file)
+        table = cache.read_table(path)
+        distance = utils.read_distance(path)
+        cross_time = table.records["cross_duration"].tolist()
+        return {name: (distance, t) for name, t in zip(table.names, cross_time)}
+
+    def refresh(self) -> None:
+        """Read the races that were added or modified, and compute the totals"""
+        files = [
+            f for f in os.listdir(self.directory) if (f[0] != ".") and f[-4:] == ".csv"
+        ]
+        changed = False
+        for file in files:
+            mtime = os.stat(os.path.join(self.directory, file)).st_mtime_ns
+            if (file not in self.races) or (self.races[file][0] != mtime):
+                self.races[file] = (mtime, self.race_totals(file))
+                changed = True
+        for file in list(self.races):
+            if file not in files:
+                self.races.pop(file)
+                changed = True
+        if changed:
+            os.makedirs(cache.cache_dir, exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.races, f)
+            os.replace(tmp, self.path)
+
+        # cumulative[r] holds the totals over the r first races
+        self.order = sorted(files, key=self.key)
+        self.keys = [self.key(file) for file in self.order]
+        totals: dict[str, tuple[float, float]] = {}
+        self.cumulative = [totals]
+        for file in self.order:
+            totals = totals.copy()
+            for name, (d, t) in self.races[file][1].items():
+                total_d, total_t = totals.get(name, (0.0, 0.0))
+                totals[name] = (total_d + d, total_t + t)
+            self.cumulative.append(totals)
+
+    def totals_before(self, file: str) -> dict[str, tuple[float, float]]:
+        """Distance and time of each athlete over the races before this one"""
+        return self.cumulative[bisect.bisect_left(self.keys, self.key(file))]
+
+
+indexes: dict[str, SeasonIndex] = {}
+
+
+def get_index(directory: str, key: Callable[[str], Any]) -> SeasonIndex:
+    """Return the index of the folder, built once per process and kept up to date"""
+    if directory in indexes:
+        indexes[directory].refresh()
+    else:
+        indexes[directory] = SeasonIndex(directory, key)
+    return indexes[directory]
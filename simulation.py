@@ -1,16 +1,265 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import random
+import bisect
+import heapq
+import os
 
 import matplotlib.pyplot as plt
+import numpy
 import pandas
 
 import athlete
+import cache
 import render
+import telemetry
 import utils
-
-# Initialiez random seed
+from profiler import Profiler
+
+
+def exact_rate(
+    names: list[str], expected: list[int], ranks: list[int]
+) -> tuple[int, int, float]:
+    """Count the athletes whose simulated rank is their real rank"""
+    n = len(names)
+    exact_position = 0
+    for i in range(n):
+        # Count the number of exact position
+        if expected[i] == ranks[i]:
+            exact_position += 1
+    return (exact_position, n, exact_position / n * 100)
+
+
+def adapted_rate(
+    names: list[str], expected: list[int], ranks: list[int]
+) -> tuple[int, int, float]:
+    """Count the pairs of athletes that are in the same order in the real race and in
+    the simulation"""
+    n = len(names)
+    real_rank = ["" for _ in range(max(expected))]
+    simu_rank = ["" for _ in range(max(ranks))]
+    for i in range(n):
+        real_rank[expected[i] - 1] = names[i]
+        simu_rank[ranks[i] - 1] = names[i]
+
+    # List athletes before and after each athlete, both in the real race and in the simulation
+    afters_real: dict[str, list[str]] = {}
+    afters_simu: dict[str, set[str]] = {}
+    before_real: dict[str, list[str]] = {}
+    before_simu: dict[str, set[str]] = {}
+    i = 0
+    for k in range(min(len(simu_rank), len(real_rank))):
+        if (real_rank[k] == "") or (simu_rank[k] == ""):
+            continue
+        afters_real[real_rank[i]] = real_rank[i + 1 :]
+        afters_simu[simu_rank[i]] = set(simu_rank[i + 1 :])
+        before_real[real_rank[i]] = real_rank[:i]
+        before_simu[simu_rank[i]] = set(simu_rank[:i])
+        i += 1
+
+    # Count the number of athlete that are in the correct part (before and after an athlete)
+    adapted_position = 0
+    total = int((n - 1) * n)
+    for a in afters_real:
+        if a not in afters_simu:
+            continue
+        for after in afters_real[a]:
+            if after in afters_simu[a]:
+                adapted_position += 1
+    for a in before_real:
+        if a not in before_simu:
+            continue
+        for before in before_real[a]:
+            if before in before_simu[a]:
+                adapted_position += 1
+
+    return (adapted_position, total, adapted_position / total * 100)
+
+
+# Points of the first places, see cup_points
+POINTS = [
+    100,
+    90,
+    80,
+    70,
+    60,
+    55,
+    52,
+    49,
+    46,
+    43,
+    40,
+    38,
+    36,
+    34,
+    32,
+    30,
+    28,
+    26,
+    24,
+    22,
+    20,
+    19,
+    18,
+    17,
+    16,
+    15,
+    14,
+    13,
+    12,
+    11,
+    10,
+    9,
+    8,
+    7,
+    6,
+    5,
+    4,
+    3,
+    2,
+    1,
+]
+
+
+def cup_points(rank: int) -> int:
+    """Points given for a rank, 0 after the last place of POINTS"""
+    if rank - 1 >= len(POINTS):
+        return 0
+    return POINTS[rank - 1]
+
+
+def speed_ratio(energy: numpy.ndarray) -> numpy.ndarray:
+    """Speed over the average speed at an energy level, as in Athlete.update"""
+    return numpy.where(
+        energy >= 83,
+        1.25,
+        numpy.where(energy >= 55, 0.009 * energy + 0.5, 0.013 * energy + 0.28),
+    )
+
+
+def energy_drift(ratio: numpy.ndarray, use_random: bool) -> numpy.ndarray:
+    """Mean energy change of a step, over avg_speed * dt / 10, for an athlete skiing
+    alone at ratio * avg_speed. With use_random, the speed is also multiplied by m,
+    uniform in [0.9, 1.1], and the loss is 2.47 times the gain, so this is the mean of
+    mult * (1 - ratio * m) over m"""
+    if not use_random:
+        return numpy.where(ratio > 1, 2.47, 1.0) * (1 - ratio)
+
+    def integral(a: numpy.ndarray | float, b: numpy.ndarray | float) -> numpy.ndarray:
+        return (b - a) - ratio * (b * b - a * a) / 2
+
+    # The energy goes down for m > 1 / ratio
+    c = numpy.clip(1 / ratio, 0.9, 1.1)
+    return (integral(0.9, c) + 2.47 * integral(c, 1.1)) / 0.2
+
+
+# use_random -> result of free_skiing
+free_skiing_tables: dict[
+    bool, tuple[float, list[tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]]
+] = {}
+
+
+def free_skiing(
+    use_random: bool,
+) -> tuple[float, list[tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]]:
+    """Energy and distance of an athlete skiing alone, against x = avg_speed * time.
+    Both only depend on x, the energy goes to the level where energy_drift is 0.
+    Return this level and, for the athletes starting above it and below it, the
+    arrays (x, energy, distance) from an energy of 100 and 0"""
+    if use_random in free_skiing_tables:
+        return free_skiing_tables[use_random]
+
+    # The drift decreases with the energy
+    low, high = 0.0, 100.0
+    for _ in range(60):
+        mid = (low + high) / 2
+        if energy_drift(speed_ratio(numpy.array(mid)), use_random) > 0:
+            low = mid
+        else:
+            high = mid
+    rest = (low + high) / 2
+    rest_ratio = float(speed_ratio(numpy.array(rest)))
+
+    branches = []
+    for end in (100.0, 0.0):
+        # The athlete gets closer and closer to rest without reaching it
+        energy = rest + (end - rest) * numpy.geomspace(1, 1e-12, 20000)
+        ratio = speed_ratio(energy)
+        # dx / denergy = 10 / drift and ddistance / dx = ratio
+        dx = 10 / energy_drift(ratio, use_random)
+        x = numpy.append(0, numpy.cumsum(numpy.diff(energy) * (dx[1:] + dx[:-1]) / 2))
+        distance = numpy.append(
+            0, numpy.cumsum(numpy.diff(x) * (ratio[1:] + ratio[:-1]) / 2)
+        )
+        # Then the athlete stays at rest
+        far = 1e12
+        distance = numpy.append(distance, distance[-1] + (far - x[-1]) * rest_ratio)
+        x = numpy.append(x, far)
+        energy = numpy.append(energy, rest)
+        branches.append((x, energy, distance))
+
+    free_skiing_tables[use_random] = (rest, branches)
+    return rest, branches
+
+
+def ski_alone(
+    energy: numpy.ndarray,
+    avg_speed: numpy.ndarray,
+    duration: float | numpy.ndarray,
+    use_random: bool,
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Energy and distance travelled after 'duration' seconds (one for all or one per
+    athlete) of athletes skiing alone, without boost, from free_skiing"""
+    rest, branches = free_skiing(use_random)
+    duration = numpy.broadcast_to(duration, len(energy))
+    new_energy = numpy.empty(len(energy))
+    distance = numpy.empty(len(energy))
+    above = energy >= rest
+    for up, (x, e, d) in zip((True, False), branches):
+        k = above if up else ~above
+        if up:
+            # The energy goes down along x, numpy.interp needs it increasing
+            x0 = numpy.interp(energy[k], e[::-1], x[::-1])
+        else:
+            x0 = numpy.interp(energy[k], e, x)
+        x1 = x0 + avg_speed[k] * duration[k]
+        new_energy[k] = numpy.interp(x1, x, e)
+        distance[k] = numpy.interp(x1, x, d) - numpy.interp(x0, x, d)
+    return new_energy, distance
+
+
+class RaceContext:
+    """What all the runs of a race share and never change: the parsed table, the
+    distance and the totals of the earlier races (see Simulation.load_history).
+    Built once, then each run only creates its own athletes, see
+    Simulation.load_context"""
+
+    __slots__ = ("path", "table", "distance", "history")
+
+    def __init__(
+        self,
+        path: str,
+        table: athlete.AthleteTable,
+        distance: int,
+        history: dict[str, tuple[float, float]] | None = None,
+    ) -> None:
+        self.path = path
+        self.table = table
+        self.distance = distance
+        self.history = history
+        # The cached tables are already read only
+        if table.records.flags.writeable:
+            table.records.flags.writeable = False
+
+    @classmethod
+    def from_csv(
+        cls, path: str, history: dict[str, tuple[float, float]] | None = None
+    ) -> "RaceContext":
+        return cls(path, cache.read_table(path), utils.read_distance(path), history)
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
 
 
 class Simulation(render.SimuRender):
@@ -22,38 +271,101 @@ class Simulation(render.SimuRender):
     t: float = 0.0
     dt: float = 0.0
     distance: float = 0.0
+    # The clock counts the steps, self.t is tick * dt (see next_tick)
+    tick = 0
+    step_ms = 0
 
     # Simulation status
     num_athlete: int = 0
     max_place: int = -1
     use_random = False
 
+    # Telemetry, see enable_recorder
+    recorder: telemetry.Recorder | None = None
+    record_interval = 0.0
+    record_channels: tuple[str, ...] = ()
+    # Channels the recorder can use, None for all the attributes of Athlete
+    recordable: tuple[str, ...] | None = None
+    # Time spent in each phase, see enable_profiler
+    profiler: Profiler | None = None
+    # Integration of the athletes, see set_integrator
+    integrators: tuple[str, ...] = ("euler",)
+    integrator = "euler"
+    tolerance = 1e-4
+    max_level = 5
+    # Largest step near the slipstream, the boost and the finish, see VectorSim
+    edge_step = 0.05
+    # Start of the athletes, see set_start
+    start_modes = ("pursuit", "wave", "mass")
+    start_mode = "pursuit"
+    wave_size = 10
+    wave_gap = 30.0
+
+    def __init__(
+        self,
+        dt: float,
+        name: str = "",
+        seed: "int | numpy.random.SeedSequence | None" = None,
+    ) -> None:
+        self.dt = dt
+        self.name = name
+        self.set_seed(seed)
+
+    def set_seed(self, seed: "int | numpy.random.SeedSequence | None") -> None:
+        """Draw all the random numbers of the simulation from a new generator.
+        seed can be an int, a SeedSequence (for example spawned for a worker) or None
+        for a random seed. self.seed is the entropy, to run it again"""
+        if not isinstance(seed, numpy.random.SeedSequence):
+            seed = numpy.random.SeedSequence(seed)
+        self.seed = seed.entropy
+        self.rng = numpy.random.default_rng(seed)
+        self.stream = utils.RandomStream(self.rng)
+        for a in self.all_athletes:
+            a.stream = self.stream
+
     def read_csv(self, path_file: str) -> tuple[pandas.DataFrame, int]:
         data = pandas.read_csv(path_file)
-        if path_file.find("_") == -1:
-            raise AttributeError("Cannot find the distance in the file name")
-        distance = int(path_file.split("_")[-1].split(".")[0]) * 1000
-        return data, distance
+        return data, utils.read_distance(path_file)
+
+    def read_table(self, path_file: str) -> tuple[athlete.AthleteTable, int]:
+        """Same as read_csv, but return the table, cached by cache.py"""
+        distance = utils.read_distance(path_file)
+        return cache.read_table(path_file), distance
 
     def load_csv(self, path_file: str) -> None:
         """Load the csv, create the list of athletes waiting"""
         self.file = path_file
-        self.data, self.distance = self.read_csv(path_file)
+        table, self.distance = self.read_table(path_file)
+        self.load_table(table)
+
+    def load_context(self, context: RaceContext) -> None:
+        """Same as load_csv and load_history, from a context shared between runs"""
+        self.file = context.path
+        self.distance = context.distance
+        self.load_table(context.table)
+        if context.history is not None:
+            self.load_history(context.history)
+
+    def load_table(self, table: athlete.AthleteTable) -> None:
+        """Create the list of athletes from an already parsed table"""
+        self.table = table
+        names = table.names
         self.all_athletes = []
 
         # For each record of athlete, create an Athlete object
-        for i in range(len(self.data["name"])):
-            self.num_athlete += 1
-            A = athlete.Athlete(
-                self.data["name"][i], self.dt, dict(self.data.iloc[i]), self.use_random
-            )
+        for i in range(len(table)):
+            A = athlete.Athlete(names[i], self.dt, table.row(i), self.use_random)
+            A.index = i
+            A.stream = self.stream
             self.all_athletes.append(A)
-            self.max_place = max(self.max_place, A.starting_place + 1)
+        self.num_athlete += len(table)
+        if len(table) != 0:
+            places = table.records["starting_place"]
+            self.max_place = max(self.max_place, int(places.max()) + 1)
 
         # Rendering records
-        self.time = {name: [] for name in self.data["name"]}
-        self.dist = {name: [] for name in self.data["name"]}
-        self.frames = {}
+        self.time = {name: [] for name in names}
+        self.dist = {name: [] for name in names}
 
     def update(self) -> None:
         """Update the state of the simulation."""
@@ -73,33 +385,164 @@ class Simulation(render.SimuRender):
             "Cannot use this class to simulate, please use a derived class"
         )
 
+    def load_history(self, totals: dict[str, tuple[float, float]]) -> None:
+        """Add the distance and time of earlier races to the athletes.
+        Same as prepare_race for all earlier races, see season.SeasonIndex"""
+        for a in self.all_athletes:
+            if a.name in totals:
+                d, t = totals[a.name]
+                a.total_distance += d
+                a.total_time += t
+
+    def enable_recorder(
+        self, interval: float = 0.0, channels: tuple[str, ...] = ("speed", "energy")
+    ) -> None:
+        """Record these attributes of the athletes every 'interval' seconds (every
+        step if 0) in self.recorder. Should be used before self.start"""
+        if self.recordable is not None:
+            unknown = [c for c in channels if c not in self.recordable]
+            if len(unknown) != 0:
+                raise ValueError(
+                    f"{type(self).__name__} cannot record {', '.join(unknown)}, "
+                    f"choose from {', '.join(self.recordable)}"
+                )
+        self.record_interval = interval
+        self.record_channels = channels
+
+    def enable_profiler(self) -> Profiler:
+        """Time the phases of the simulation (update, ranking, rendering, ...)
+        in self.profiler. Without it, nothing is measured"""
+        self.profiler = Profiler()
+        self.profiler.attach(self)
+        return self.profiler
+
+    def set_integrator(self, integrator: str, tolerance: float = 1e-4) -> None:
+        """Integrate the athletes with "euler", one Euler step of dt per step, or
+        "adaptive": up to 2 ** max_level Euler steps per step, so that the error on
+        the energy of each step stays under tolerance, and steps of at most edge_step
+        for the athletes that can draft, boost or finish. It lowers the bias of a
+        step, it is not a faster way to get the ranks: in a field in packs, most
+        athletes take the steps of edge_step, and euler with a smaller dt is cheaper"""
+        if integrator not in self.integrators:
+            raise ValueError(
+                f"{type(self).__name__} cannot use the '{integrator}' integrator, "
+                f"choose from {', '.join(self.integrators)}"
+            )
+        self.integrator = integrator
+        self.tolerance = tolerance
+
+    def set_start(self, mode: str, wave_size: int = 10, wave_gap: float = 30.0) -> None:
+        """Start the athletes with "pursuit", at their time behind the winner of the
+        jump (the default), "wave": in groups of wave_size athletes in the order of
+        the jump, one group every wave_gap seconds, or "mass": all together"""
+        if mode not in self.start_modes:
+            raise ValueError(
+                f"Unknow start '{mode}', choose from {', '.join(self.start_modes)}"
+            )
+        self.start_mode = mode
+        self.wave_size = wave_size
+        self.wave_gap = wave_gap
+
+    def place_starts(self) -> None:
+        """Set the start of the athletes for self.start_mode, see set_start"""
+        for a in self.all_athletes:
+            a.start = None
+        if self.start_mode == "pursuit":
+            return
+        order = sorted(self.all_athletes, key=lambda a: a.start_time())
+        for k, a in enumerate(order):
+            if self.start_mode == "mass":
+                a.start = 0.0
+            else:
+                a.start = (k // self.wave_size) * self.wave_gap
+
+    def next_tick(self) -> None:
+        """Move the clock one step forward. The time is a number of steps, so that
+        it does not drift, and it is rounded to the millisecond as the times of the
+        athletes"""
+        self.tick += 1
+        self.t = round(self.tick * self.dt, 3)
+
+    def on_second(self) -> bool:
+        """If self.t is a whole second"""
+        return (self.tick * self.step_ms) % 1000 == 0
+
+    def starting(self) -> list[tuple[athlete.Athlete, float]]:
+        """Take the athletes starting by self.t out of self.waiting, with how late
+        they are: a start between two steps is seen at the next step"""
+        now = self.tick * self.step_ms
+        out = []
+        while (len(self.waiting) != 0) and (self.waiting[0][0] <= now):
+            start, _, a = heapq.heappop(self.waiting)
+            out.append((a, (now - start) / 1000))
+        return out
+
+    def enter(self, a: athlete.Athlete, late: float) -> None:
+        """Make a start, 'late' seconds after their start: they already skied alone
+        for this long, see ski_alone"""
+        if late > 0:
+            energy, distance = ski_alone(
+                numpy.array([a.energy]),
+                numpy.array([a.avg_speed]),
+                late,
+                self.use_random,
+            )
+            a.energy = round(float(energy[0]), 6)
+            a.distance += float(distance[0])
+            a.time = late
+        self.skiing.append(a)
+
+    def num_skiing(self) -> int:
+        """Number of athletes skiing"""
+        return len(self.skiing)
+
+    def start_recorder(self, size: int) -> None:
+        """Create the recorder for 'size' athletes, with room for the whole race"""
+        if len(self.record_channels) == 0:
+            self.recorder = None
+            return
+        self.recorder = telemetry.Recorder(
+            size, self.dt, self.record_interval, self.record_channels
+        )
+        longest = max(self.distance / a.avg_speed for a in self.all_athletes)
+        self.recorder.reserve(int(1.2 * longest / self.recorder.interval) + 1)
+
     def start(self) -> None:
         """Initialize the simulation"""
+        self.step_ms = int(round(self.dt * 1000))
+        if abs(self.step_ms - self.dt * 1000) > 1e-6:
+            raise ValueError(f"The step {self.dt} is not a number of milliseconds")
 
+        # Athletes waiting to start, as (start in ms, index, athlete) in a heap
+        self.place_starts()
+        self.waiting = []
         for a in self.all_athletes:
             # Set the average speed for all athletes
             a.avg_speed = self.guess_avg_speed(a)
-            # Put all athletes in waiting zone
-            t = a.start_time()
-            if t in self.waiting:
-                self.waiting[t].append(a)
-            else:
-                self.waiting[t] = [a]
+            start = int(round(a.start_time() * 1000))
+            self.waiting.append((start, a.index, a))
+        heapq.heapify(self.waiting)
+
+        self.start_recorder(len(self.all_athletes))
+        finish = max(
+            a.start_time() + self.distance / a.avg_speed for a in self.all_athletes
+        )
+        self.start_frames(int(1.2 * finish) + 1)
 
         # Reset some variables
+        self.tick = 0
         self.t = 0.0
         self.frame = 0
         self.ended = False
 
         self.done = []
         self.skiing = []
+        self.overtakes: list[tuple[float, str, str]] = []
+        self.ranked = (0, 0)
 
         # Change the status of the first athletes
-        if self.t not in self.waiting:
-            return
-        for a in self.waiting[self.t]:
+        for a, _ in self.starting():
             self.skiing.append(a)
-        self.waiting.pop(self.t)
 
     def compare_positions(self) -> None:
         """Plot the expected and real ending position and the name for each athlete"""
@@ -123,20 +566,28 @@ class Simulation(render.SimuRender):
         plt.close()
 
     def update_rank(self) -> None:
-        places = {}
-        for i in range(len(self.skiing)):
-            places[self.skiing[i].name] = self.skiing[i].distance
-        # Sort the dict
-        places = {
-            k: v
-            for k, v in sorted(places.items(), key=lambda item: item[1], reverse=True)
-        }
+        """Keep self.skiing sorted by decreasing distance by swapping neighbours.
+        Each swap is an overtake, logged in self.overtakes as (time, overtaking
+        athlete, overtaken athlete). Ranks are only recomputed when athletes start or
+        finish, otherwise the swaps keep them correct."""
+        skiing = self.skiing
+        for k in range(1, len(skiing)):
+            a = skiing[k]
+            j = k
+            while (j > 0) and (skiing[j - 1].distance < a.distance):
+                other = skiing[j - 1]
+                a.overtake(other)
+                self.overtakes.append((self.t, a.name, other.name))
+                skiing[j - 1] = a
+                skiing[j] = other
+                j -= 1
 
         # Give the rank to the correct athlete
-        for i in range(len(self.skiing)):
-            self.skiing[i].rank = (
-                1 + len(self.done) + list(places.keys()).index(self.skiing[i].name)
-            )
+        state = (len(self.done), len(skiing))
+        if state != self.ranked:
+            for k in range(len(skiing)):
+                skiing[k].rank = 1 + len(self.done) + k
+            self.ranked = state
 
     def finish_update(self) -> None:
         self.update_rank()
@@ -145,70 +596,31 @@ class Simulation(render.SimuRender):
         if len(self.skiing) == len(self.waiting) == 0:
             self.ended = True
 
-        if round(self.t, 0) == self.t:
+        if self.on_second():
             self.frame += 1
             self.render_update_data()
 
-    def excat_rate(self) -> (float, float, float):
+    def excat_rate(self) -> tuple[int, int, float]:
         if not self.ended:
             raise ValueError("Cannot use this function if the simulation did not end")
         n = self.num_athlete
         assert len(self.done) == n, "Why are those values not equal ?"
-        exact_position = 0
-        for i in range(n):
-            er = self.done[i].expected_rank
-            sr = self.done[i].rank
-            # Count the number of exact position
-            if er == sr:
-                exact_position += 1
-        return (exact_position, n, exact_position / n * 100)
-
-    def adapt_rate(self) -> (float, float, float):
+        return exact_rate(
+            [a.name for a in self.done],
+            [a.expected_rank for a in self.done],
+            [a.rank for a in self.done],
+        )
+
+    def adapt_rate(self) -> tuple[int, int, float]:
         if not self.ended:
             raise ValueError("Cannot use this function if the simulation did not end")
         n = self.num_athlete
         assert len(self.done) == n, "Why are those values not equal ?"
-
-        real_rank = ["" for _ in range(max([a.expected_rank for a in self.done]))]
-        simu_rank = ["" for _ in range(max([a.rank for a in self.done]))]
-        for i in range(n):
-            er = self.done[i].expected_rank
-            sr = self.done[i].rank
-            real_rank[er - 1] = self.done[i].name
-            simu_rank[sr - 1] = self.done[i].name
-
-        # List athletes before and after each athlete, both in the real race and in the simulation
-        afters_real: dict[str, list[str]] = {}
-        afters_simu: dict[str, list[str]] = {}
-        before_real: dict[str, list[str]] = {}
-        before_simu: dict[str, list[str]] = {}
-        i = 0
-        for k in range(min(len(simu_rank), len(real_rank))):
-            if (real_rank[k] == "") or (simu_rank[k] == ""):
-                continue
-            afters_real[real_rank[i]] = real_rank[i + 1 :]
-            afters_simu[simu_rank[i]] = simu_rank[i + 1 :]
-            before_real[real_rank[i]] = real_rank[:i]
-            before_simu[simu_rank[i]] = simu_rank[:i]
-            i += 1
-
-        # Count the number of athlete that are in the correct part (before and after an athlete)
-        adapted_position = 0
-        total = int((n - 1) * n)
-        for a in afters_real:
-            if a not in afters_simu:
-                continue
-            for after in afters_real[a]:
-                if after in afters_simu[a]:
-                    adapted_position += 1
-        for a in before_real:
-            if a not in before_simu:
-                continue
-            for before in before_real[a]:
-                if before in before_simu[a]:
-                    adapted_position += 1
-
-        return (adapted_position, total, adapted_position / total * 100)
+        return adapted_rate(
+            [a.name for a in self.done],
+            [a.expected_rank for a in self.done],
+            [a.rank for a in self.done],
+        )
 
     def correctness(self) -> None:
         exact_position, n, per_e = self.excat_rate()
@@ -225,29 +637,22 @@ class Simulation(render.SimuRender):
         else:
             r = range(num, num + 1, 1)
 
-        # print(self.done[1].energies[-1])
-        # self.done[0].energies.append(325)
-        # print(self.done[1].energies[-1])
-
-        # print(self.done[1].energy)
-        # self.done[0].energy = 325
-        # print(self.done[1].energy)
+        if self.recorder is None:
+            raise ValueError("Use enable_recorder before starting the simulation")
 
-        # if self.done[0].energies == self.done[1].energies:
-        #     print("problem")
         done = 0
         print("")
         # plt.ylim(-5, 105)
         for a in r:
             athlete = self.done[a]
             # print(athlete.name)
-            speed = athlete.speeds[athlete.name]
+            speed = self.recorder.get("speed", athlete.index)
             # plt.plot(
             #     [(i + athlete.start_time()) / 60 for i in range(len(energy))],
             #     [i * 3.6 for i in energy],
             # )
 
-            sample_per_min = 60 / self.dt
+            sample_per_min = 60 / self.recorder.interval
             avg = []
             for i in range(len(speed)):
                 if i < (sample_per_min // 2):
@@ -259,9 +664,7 @@ class Simulation(render.SimuRender):
                 else:
                     min = i - sample_per_min // 2
                     max = i + sample_per_min // 2 + 1
-                avg.append(
-                    sum(speed[int(min) : int(max)]) / len(speed[int(min) : int(max)])
-                )
+                avg.append(float(speed[int(min) : int(max)].mean()))
 
             # Code for aproximating energy multiplier
             # above = 0
@@ -275,7 +678,10 @@ class Simulation(render.SimuRender):
             # print(f"Above: {above}, below = {below}, diff = {above - below}")
 
             plt.plot(
-                [(i * self.dt + athlete.start_time()) / 60 for i in range(len(speed))],
+                [
+                    (i * self.recorder.interval + athlete.start_time()) / 60
+                    for i in range(len(speed))
+                ],
                 [i * 3.6 for i in avg],
             )
             # plt.plot([0, athlete.time / 60], [athlete.avg_speed * 3.6, athlete.avg_speed * 3.6])
@@ -284,9 +690,9 @@ class Simulation(render.SimuRender):
 
         # for i in r:
         #     athlete = self.done[i]
-        #     energy = athlete.energies[athlete.name]
+        #     energy = self.recorder.get("energy", athlete.index)
         #     plt.plot(
-        #         [(i * self.dt + athlete.start_time()) / 60 for i in range(len(energy))],
+        #         [(i * self.recorder.interval + athlete.start_time()) / 60 for i in range(len(energy))],
         #         energy,
         #     )
 
@@ -297,12 +703,10 @@ class Simulation(render.SimuRender):
         plt.close()
 
     def start_update(self) -> None:
-        self.t = round(self.t + self.dt, 3)
+        self.next_tick()
 
-        if self.t in self.waiting:
-            for a in self.waiting[self.t]:
-                self.skiing.append(a)
-            self.waiting.pop(self.t)
+        for a, late in self.starting():
+            self.enter(a, late)
 
         text = f"{utils.time_convert_to_str(self.t)}, {len(self.done)} / {self.num_athlete}"
         m: athlete.Athlete | None = None
@@ -314,6 +718,23 @@ class Simulation(render.SimuRender):
 
         print(text, end="\r")
 
+    def find_leaders(self) -> None:
+        """Set the athlete each skiing athlete is drafting behind, the closest one
+        between 0.5m and 2m ahead. self.skiing is kept sorted by decreasing distance
+        by update_rank, so this is O(n log n).
+        All the athletes are seen where they were at the start of the step. Before,
+        the pairs were checked during the step, and the athletes already updated
+        were seen at their new distance: the results of a race are not the same"""
+        behind = [-a.distance for a in self.skiing]
+        for a in self.skiing:
+            # Number of athletes more than 0.5m ahead, the last one is the closest
+            k = bisect.bisect_left(behind, -(a.distance + 0.5))
+            if (k > 0) and (self.skiing[k - 1].distance < a.distance + 2.0):
+                a.leader = self.skiing[k - 1]
+            else:
+                a.leader = None
+            a.in_slipstream = a.leader is not None
+
     def write(self) -> None:
         file = self.name
         if file == "":
@@ -326,59 +747,9 @@ class Simulation(render.SimuRender):
         assert self.ended
         print("")
         points = {}
-        values = [
-            100,
-            90,
-            80,
-            70,
-            60,
-            55,
-            52,
-            49,
-            46,
-            43,
-            40,
-            38,
-            36,
-            34,
-            32,
-            30,
-            28,
-            26,
-            24,
-            22,
-            20,
-            19,
-            18,
-            17,
-            16,
-            15,
-            14,
-            13,
-            12,
-            11,
-            10,
-            9,
-            8,
-            7,
-            6,
-            5,
-            4,
-            3,
-            2,
-            1,
-        ]
         for a in self.done:
-            sr = a.rank - 1
-            if sr >= len(values):
-                sp = 0
-            else:
-                sp = values[sr]
-            rr = a.expected_rank - 1
-            if rr >= len(values):
-                rp = 0
-            else:
-                rp = values[rr]
+            sp = cup_points(a.rank)
+            rp = cup_points(a.expected_rank)
             with open("points.csv", "a") as f:
                 f.write(f"{a.name}, {sp}, {rp}\n")
             # print(f"{a.name} ({a.rank}) -> {values[a.rank]}")
@@ -388,12 +759,17 @@ class Simulation(render.SimuRender):
 class SimpleSim(Simulation):
     """A simple simulation without collision, air resistance, or anything really"""
 
-    def __init__(self, dt: float) -> None:
-        self.dt = dt
+    def __init__(
+        self,
+        dt: float,
+        name: str = "",
+        seed: "int | numpy.random.SeedSequence | None" = None,
+    ) -> None:
+        super().__init__(dt, name, seed)
 
     def guess_avg_speed(self, a: athlete.Athlete) -> float:
         """Return the average speed"""
-        return self.distance / utils.time_convert_to_float(a.get("cross_time"))
+        return self.distance / a.cross_time()
 
     def update(self) -> None:
         """Update the state of the simulation.
@@ -403,9 +779,12 @@ class SimpleSim(Simulation):
         self.start_update()
 
         # Update all athletes that are not finished
+        recorder = self.recorder
         i = 0
         while i < len(self.skiing):
             self.skiing[i].update(self.dt)
+            if recorder is not None:
+                recorder.record(self.skiing[i])
             if self.skiing[i].distance >= self.distance:
                 self.done.append(self.skiing[i])
                 self.skiing.pop(i)
@@ -420,17 +799,21 @@ class SlipstreamSim(Simulation):
 
     prob_activation_boost = 0.90
 
-    def __init__(self, dt: float, name: str = "") -> None:
-        self.dt = dt
+    def __init__(
+        self,
+        dt: float,
+        name: str = "",
+        seed: "int | numpy.random.SeedSequence | None" = None,
+    ) -> None:
+        super().__init__(dt, name, seed)
         self.use_random = True
-        self.name = name
 
     def guess_avg_speed(self, a: athlete.Athlete) -> float:
         """Return the average speed"""
         t = a.total_time
         d = a.total_distance
         if (t == 0) or (d == 0):
-            t = utils.time_convert_to_float(a.get("cross_time"))
+            t = a.cross_time()
             d = self.distance
         # s = self.distance / t
         # print(f"{a.name:30}: {(s * 3.6):.05} ({self.distance}m in {t}s)")
@@ -438,15 +821,11 @@ class SlipstreamSim(Simulation):
 
     def prepare_race(self, path: str) -> None:
         """Should only be used after self.load_csv"""
-        data, distance = self.read_csv(path)
-        for k in range(len(self.all_athletes)):
-            a = self.all_athletes[k]
-            for i in range(len(data.name)):
-                if data.name[i] == self.all_athletes[k].name:
-                    self.all_athletes[k].total_distance += distance
-                    self.all_athletes[k].total_time += utils.time_convert_to_float(
-                        data.cross_time[i]
-                    )
+        table, distance = self.read_table(path)
+        cross_time = table.records["cross_duration"].tolist()
+        self.load_history(
+            {name: (distance, t) for name, t in zip(table.names, cross_time)}
+        )
 
     def update(self) -> None:
         """Update the state of the simulation.
@@ -456,35 +835,31 @@ class SlipstreamSim(Simulation):
         # Update state and add skiing athletes
         self.start_update()
 
+        # Test wether an athlete benifits from slipstream effect, from the distances
+        # at the start of the step (as VectorSim), see find_leaders
+        self.find_leaders()
+
+        recorder = self.recorder
+        stream = self.stream
         i = 0
         while i < len(self.skiing):
             a = self.skiing[i]
-
-            # Test wether an athlete benifits from slipstream effect
-            can_activate_boost = False
-            d = 0.0
-
-            for j in range(0, len(self.skiing)):
-                if i == j:
-                    continue
-                other = self.skiing[j]
-                d = other.distance - a.distance
-                # The athlete has to be < 2m behind the guy in front
-                if d < 2.0 and d > 0.5:
-                    can_activate_boost = True
-                    break
+            # The athlete has to be < 2m behind the guy in front
+            can_activate_boost = a.in_slipstream
 
             # If slipstream, you get a boost
             if not self.skiing[i].boost.is_active(self.t):
                 if can_activate_boost:
                     # Activate the boost only if the athlete can (but prob that it fails)
-                    if a.can_boost() and (random.random() < self.prob_activation_boost):
+                    if a.can_boost() and (stream.random() < self.prob_activation_boost):
                         self.skiing[i].boost.change(self.t)
                 else:
                     self.skiing[i].boost.reset()
 
             # Update the position of the athletes
             self.skiing[i].update(self.dt)
+            if recorder is not None:
+                recorder.record(a)
 
             # Remove the athlete if went over the distance (finished)
             if self.skiing[i].distance >= self.distance:
@@ -494,3 +869,653 @@ class SlipstreamSim(Simulation):
                 i += 1
 
         self.finish_update()
+
+
+class VectorSim(SlipstreamSim):
+    """Same model as SlipstreamSim, but the whole field is advanced in one batched step.
+    The state of the athletes is kept in NumPy arrays indexed by Athlete.index, the
+    Athlete objects are only updated when rendering and when they finish.
+    The arrays hold `replicas` copies of the field one after the other (replica r,
+    athlete k is at r * len(self.all_athletes) + k), see EnsembleSim."""
+
+    replicas = 1
+    integrators = ("euler", "adaptive")
+    # Built from the state arrays in step
+    recordable = ("speed", "energy", "distance", "time", "locked", "in_slipstream")
+
+    def __init__(
+        self,
+        dt: float,
+        name: str = "",
+        seed: "int | numpy.random.SeedSequence | None" = None,
+    ) -> None:
+        super().__init__(dt, name, seed)
+        boost = utils.Boost()
+        self.time_activation = boost.time_activation
+        self.time_boost = boost.time_boost
+
+    def start(self) -> None:
+        """Initialize the simulation and the state arrays"""
+        super().start()
+
+        num = len(self.all_athletes)
+        n = num * self.replicas
+        self.distances = numpy.zeros(n)
+        self.times = numpy.zeros(n)
+        self.energies = numpy.full(n, 100.0)
+        self.avg_speeds = numpy.tile(
+            [a.avg_speed for a in self.all_athletes], self.replicas
+        )
+        self.locked = numpy.zeros(n, dtype=bool)
+        self.activate_start = numpy.full(n, -1.0)
+        self.start_boost = numpy.full(n, -1.0)
+        self.ranks = numpy.full(n, -1, dtype=int)
+        self.leaders = numpy.full(n, -1, dtype=int)  # Index of the athlete ahead
+        self.is_skiing = numpy.zeros(n, dtype=bool)
+        for a in self.skiing:
+            self.is_skiing[a.index :: num] = True
+        self.done_count = numpy.zeros(self.replicas, dtype=int)
+        if self.replicas != 1:
+            self.start_recorder(n)
+        # Offset between replicas so that they can be sorted together
+        self.lane = 2.0 * self.distance + 10.0
+
+    def start_update(self) -> None:
+        self.next_tick()
+
+        starting = self.starting()
+        if len(starting) != 0:
+            self.enter_all(starting)
+            self.skiing += [a for a, _ in starting]
+
+        # Printing every step would cost more than the step itself
+        if self.on_second():
+            self.show_progress()
+
+    def enter_all(self, starting: list[tuple[athlete.Athlete, float]]) -> None:
+        """Make the athletes start in all the replicas, see Simulation.enter"""
+        num = len(self.all_athletes)
+        index = numpy.array([a.index for a, _ in starting])
+        idx = (index + num * numpy.arange(self.replicas)[:, None]).ravel()
+        self.is_skiing[idx] = True
+        late = numpy.tile([late for _, late in starting], self.replicas)
+        if (late > 0).any():
+            idx = idx[late > 0]
+            late = late[late > 0]
+            energy, distance = ski_alone(
+                self.energies[idx], self.avg_speeds[idx], late, self.use_random
+            )
+            self.energies[idx] = numpy.round(energy, 6)
+            self.distances[idx] += distance
+            self.times[idx] = late
+
+    def show_progress(self) -> None:
+        text = f"{utils.time_convert_to_str(self.t)}, {len(self.done)} / {self.num_athlete}"
+        if self.is_skiing.any():
+            m = self.distances[self.is_skiing].max()
+            text = f"{text}, {int(self.distance - m):05}m to go"
+        print(text, end="\r")
+
+    def step(self, idx: numpy.ndarray) -> None:
+        """Advance the athletes in idx by dt. Same model as SlipstreamSim.update and
+        Athlete.update, with all athletes seeing the distances from the start of the step
+        """
+        t = self.t
+        dt = self.dt
+        n = len(idx)
+        distance = self.distances[idx]
+        energy = self.energies[idx]
+        avg_speed = self.avg_speeds[idx]
+        clock = self.times[idx]
+        locked = self.locked[idx]
+        activate_start = self.activate_start[idx]
+        start_boost = self.start_boost[idx]
+
+        # Slipstream: the closest athlete more than 0.5m ahead is less than 2m ahead
+        key = distance + (idx // len(self.all_athletes)) * self.lane
+        order = numpy.argsort(key, kind="stable")
+        ordered = key[order]
+        closest = numpy.searchsorted(ordered, key + 0.5, side="right")
+        closest = numpy.minimum(closest, n - 1)
+        in_slipstream = (ordered[closest] > key + 0.5) & (ordered[closest] < key + 2.0)
+        self.leaders[idx] = numpy.where(in_slipstream, idx[order[closest]], -1)
+
+        # Activate (or reset) the boost, see utils.Boost
+        active = (start_boost >= 0) & ((t - start_boost) < self.time_boost)
+        can_boost = (~locked) & (energy > 50)
+        trigger = (
+            (~active)
+            & in_slipstream
+            & can_boost
+            & (self.rng.random(n) < self.prob_activation_boost)
+        )
+        first = trigger & (activate_start < 0)
+        launch = (
+            trigger
+            & (activate_start >= 0)
+            & ((t - activate_start) > self.time_activation)
+        )
+        activate_start = numpy.where(first, t, activate_start)
+        start_boost = numpy.where(launch, t, start_boost)
+        reset = (~active) & (~in_slipstream)
+        activate_start[reset] = -1.0
+        start_boost[reset] = -1.0
+
+        # Random factor of the speed
+        m = numpy.ones(n)
+        if self.use_random:
+            m = 1 + (self.rng.random(n) - 0.5) / 5
+
+        # If in slipstream, recover some energy
+        charge = numpy.where(activate_start != -1, 0.1, 0.0)
+        locked &= energy + charge * dt <= 70
+
+        # Launch the boost
+        active = (start_boost >= 0) & ((clock - start_boost) < self.time_boost)
+        can_boost = (~locked) & (energy + charge * dt > 50)
+        boosted = active & can_boost
+        failed = active & (~can_boost)
+        start_boost = numpy.where(failed, clock, start_boost)
+        locked |= failed
+
+        energy, travelled, s = self.integrate(
+            energy, avg_speed, m, charge, boosted, start_boost, clock
+        )
+        distance += travelled
+        energy = numpy.round(energy, 6)
+        self.distances[idx] = distance
+        self.times[idx] = numpy.round(clock + dt, 3)
+        self.energies[idx] = energy
+        self.locked[idx] = locked
+        self.activate_start[idx] = activate_start
+        self.start_boost[idx] = start_boost
+
+        if self.recorder is not None:
+            values = {
+                "speed": s,
+                "energy": energy,
+                "distance": distance,
+                "time": self.times[idx],
+                "locked": locked,
+                "in_slipstream": in_slipstream,
+            }
+            self.recorder.record_arrays(idx, values)
+
+    def euler(
+        self,
+        energy: numpy.ndarray,
+        avg_speed: numpy.ndarray,
+        m: numpy.ndarray,
+        charge: numpy.ndarray,
+        boosted: numpy.ndarray,
+        start_boost: numpy.ndarray,
+        clock: numpy.ndarray,
+        dt: float,
+    ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """One explicit Euler step of dt, as Athlete.update. Return the energy, the
+        distance travelled and the speed"""
+        p = numpy.where(
+            energy >= 83,
+            125.0,
+            numpy.where(energy >= 55, 0.9 * energy + 50, 1.3 * energy + 28),
+        )
+        s = p / 100 * avg_speed
+        s *= m
+        # The boost stops time_boost after it started, even inside a step
+        boosted = boosted & ((clock - start_boost) < self.time_boost)
+        s = numpy.where(boosted, s * 1.5, s)
+
+        ds = avg_speed - s
+        mult = numpy.where(ds < 0.0, 2.47, 1.0)
+        energy = numpy.clip(energy + charge * dt + mult * dt * ds / 10, 0, 100)
+        return energy, s * dt, s
+
+    def integrate(
+        self,
+        energy: numpy.ndarray,
+        avg_speed: numpy.ndarray,
+        m: numpy.ndarray,
+        charge: numpy.ndarray,
+        boosted: numpy.ndarray,
+        start_boost: numpy.ndarray,
+        clock: numpy.ndarray,
+    ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Energy, distance travelled and speed after self.dt, see euler.
+        With the adaptive integrator, the athletes whose step crosses an edge (83
+        or 55, the clamp at 0 or 100, the end of the boost) take 2 ** level Euler
+        steps. The level comes from the difference between one step and two half
+        steps, elsewhere the dynamics are smooth and one step is enough"""
+        args = (avg_speed, m, charge, boosted, start_boost)
+        dt = self.dt
+        one = self.euler(energy, *args, clock, dt)
+        if self.integrator == "euler":
+            return one
+
+        after = one[0]
+        edge = (after <= 0) | (after >= 100)
+        for threshold in (83, 55):
+            edge |= (energy >= threshold) != (after >= threshold)
+        edge |= boosted & ((clock + dt - start_boost) >= self.time_boost)
+        sel = numpy.flatnonzero(edge)
+        if len(sel) == 0:
+            return one
+
+        e = energy[sel]
+        avg, factor, ch, on, since = (v[sel] for v in args)
+        c = clock[sel]
+        half, _, _ = self.euler(e, avg, factor, ch, on, since, c, dt / 2)
+        two, _, _ = self.euler(half, avg, factor, ch, on, since, c + dt / 2, dt / 2)
+        # The error of the step is about halved at each level
+        error = numpy.maximum(numpy.abs(after[sel] - two), 1e-300)
+        level = numpy.clip(
+            numpy.ceil(numpy.log2(error / self.tolerance)), 0, self.max_level
+        ).astype(int)
+
+        energy_out, travelled, speed = (v.copy() for v in one)
+        for k in numpy.unique(level[level > 0]):
+            at = level == k
+            h = dt / 2**k
+            e = energy[sel[at]]
+            d = numpy.zeros(at.sum())
+            sub = (avg[at], factor[at], ch[at], on[at], since[at])
+            for j in range(2**k):
+                e, dd, _ = self.euler(e, *sub, c[at] + j * h, h)
+                d += dd
+            energy_out[sel[at]] = e
+            travelled[sel[at]] = d
+            speed[sel[at]] = d / dt
+        return energy_out, travelled, speed
+
+    def sync(self, athletes: list[athlete.Athlete]) -> None:
+        """Copy the state arrays back into the Athlete objects"""
+        for a in athletes:
+            k = a.index
+            a.distance = float(self.distances[k])
+            a.time = float(self.times[k])
+            a.energy = float(self.energies[k])
+            a.locked = bool(self.locked[k])
+            a.rank = int(self.ranks[k])
+            leader = int(self.leaders[k])
+            a.leader = None if leader == -1 else self.all_athletes[leader]
+            a.in_slipstream = a.leader is not None
+
+    def update(self) -> None:
+        """Update the state of the simulation.
+        If some athlete can now start the cross crountry, make them start.
+        Remove the athlete from the race if they finished."""
+
+        self.start_update()
+
+        idx = numpy.flatnonzero(self.is_skiing)
+        if len(idx) != 0:
+            finished = self.advance(idx)
+            if len(finished) != 0:
+                self.add_done(finished)
+
+        self.finish_update()
+
+    def add_done(self, finished: numpy.ndarray) -> None:
+        """Move the athletes that finished (see remove_finished) from skiing to
+        done"""
+        done = [self.all_athletes[k] for k in finished]
+        self.sync(done)
+        self.done += done
+        self.skiing = [a for a in self.skiing if self.is_skiing[a.index]]
+
+    def advance(self, idx: numpy.ndarray) -> numpy.ndarray:
+        """Step the athletes in idx by dt, stop and return the ones that finished"""
+        if self.integrator == "adaptive":
+            return self.adaptive_step(idx)
+        self.step(idx)
+        return self.remove_finished(idx)
+
+    def edge_substeps(self) -> int:
+        """Number of steps of at most edge_step in dt. They are a whole number of
+        milliseconds, as the times are rounded to the millisecond"""
+        ms = int(round(self.dt * 1000))
+        n = max(int(numpy.ceil(self.dt / self.edge_step - 1e-9)), 1)
+        while ms % n != 0:
+            n += 1
+        return n
+
+    def near_edges(self, idx: numpy.ndarray) -> numpy.ndarray:
+        """Which athletes of idx can reach the slipstream of another athlete during
+        dt, have their boost charging or on, or can finish"""
+        avg_speed = self.avg_speeds[idx]
+        # Two athletes cannot close more than 2 * avg_speed * dt during dt
+        reach = 2.0 + 2 * avg_speed.max() * self.dt
+        key = self.distances[idx] + (idx // len(self.all_athletes)) * self.lane
+        order = numpy.argsort(key, kind="stable")
+        close = numpy.diff(key[order]) < reach
+        near = numpy.zeros(len(idx), dtype=bool)
+        near[order[:-1]] |= close
+        near[order[1:]] |= close
+        near |= (self.activate_start[idx] >= 0) | (self.start_boost[idx] >= 0)
+        near |= self.distances[idx] + 2 * avg_speed * self.dt >= self.distance
+        return near
+
+    def adaptive_step(self, idx: numpy.ndarray) -> numpy.ndarray:
+        """advance with the adaptive integrator. The athletes near an edge (see
+        near_edges) are stepped edge_substeps times, so that the slipstream, the
+        boost and the finish are seen as with a step of edge_step. The others, far
+        from everyone, take one step of dt where integrate chooses their level"""
+        n = self.edge_substeps()
+        if (n == 1) or (self.recorder is not None):
+            # The recorder samples every dt
+            self.step(idx)
+            return self.remove_finished(idx)
+
+        near = self.near_edges(idx)
+        coarse = idx[~near]
+        fine = idx[near]
+        finished = [numpy.zeros(0, dtype=int)]
+        if len(coarse) != 0:
+            self.step(coarse)
+            finished.append(self.remove_finished(coarse))
+        # The ranks are only needed when an athlete finishes
+        finishing = (
+            self.distances[fine] + 2 * self.avg_speeds[fine] * self.dt >= self.distance
+        ).any()
+        t = self.t
+        dt = self.dt
+        self.dt = round(dt / n, 3)
+        for j in range(n):
+            if len(fine) == 0:
+                break
+            # As in step, the step at self.t goes from self.t to self.t + dt
+            self.t = round(t + j * self.dt, 3)
+            self.step(fine)
+            done = self.remove_finished(fine)
+            if len(done) != 0:
+                finished.append(done)
+                fine = fine[self.is_skiing[fine]]
+            if finishing:
+                self.update_rank()
+        self.t = t
+        self.dt = dt
+        return numpy.concatenate(finished)
+
+    def remove_finished(self, idx: numpy.ndarray) -> numpy.ndarray:
+        """Stop the athletes in idx that went over the distance and return them"""
+        finished = idx[self.distances[idx] >= self.distance]
+        self.is_skiing[finished] = False
+        self.done_count += numpy.bincount(
+            finished // len(self.all_athletes), minlength=self.replicas
+        )
+        return finished
+
+    def update_rank(self) -> None:
+        idx = numpy.flatnonzero(self.is_skiing)
+        rows = idx // len(self.all_athletes)
+        # Sort by replica, then by decreasing distance
+        order = numpy.argsort(rows * self.lane - self.distances[idx], kind="stable")
+        idx = idx[order]
+        rows = rows[order]
+        first = numpy.searchsorted(rows, rows, side="left")
+        place = numpy.arange(len(idx)) - first
+        self.ranks[idx] = 1 + self.done_count[rows] + place
+
+    def render_update_data(self) -> None:
+        # The rendering reads the Athlete objects
+        self.sync(self.skiing)
+        super().render_update_data()
+
+
+class EventSim(VectorSim):
+    """VectorSim without the random factors, where the athletes alone (nobody within
+    2m, no boost) follow ski_alone up to the next event instead of stepping by dt"""
+
+    # Longest jump in seconds, the bounds of speed_bounds hold for this long
+    max_jump = 10.0
+    # Shorter jumps are done with VectorSim.update
+    min_jump_steps = 4
+    # After a jump too short, the next ones are only looked for after 1, 2, 4... steps
+    max_retry = 64
+    # Stop at every second, so that all the frames are recorded for the rendering
+    every_frame = True
+
+    def __init__(
+        self,
+        dt: float,
+        name: str = "",
+        seed: "int | numpy.random.SeedSequence | None" = None,
+    ) -> None:
+        super().__init__(dt, name, seed)
+        self.use_random = False
+
+    def start(self) -> None:
+        if self.replicas != 1:
+            raise ValueError("EventSim only simulates one replica")
+        if self.use_random:
+            # The jumps would not have the spread of the steps of dt
+            raise ValueError("EventSim cannot use the random factors")
+        super().start()
+        # During a jump, the athletes are ranked by block first, see update
+        self.block = numpy.zeros(len(self.all_athletes), dtype=int)
+        self.retry = 0
+        self.wait = 0
+
+    def speed_bounds(
+        self, idx: numpy.ndarray, alone: numpy.ndarray
+    ) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """Lowest and highest speeds of the athletes in idx during max_jump"""
+        avg_speed = self.avg_speeds[idx]
+        energy = self.energies[idx]
+        # The others can boost
+        top = 1.25 * 1.5 * avg_speed
+        # Fastest energy loss, see VectorSim.step
+        loss = 2.47 * (top - avg_speed) / 10 * self.max_jump
+        low = speed_ratio(numpy.maximum(energy - loss, 0)) * avg_speed
+
+        # The energy of the athletes alone goes straight to the rest level
+        rest = free_skiing(self.use_random)[0]
+        top_alone = speed_ratio(numpy.maximum(energy, rest)) * avg_speed
+        low_alone = speed_ratio(numpy.minimum(energy, rest)) * avg_speed
+        return numpy.where(alone, low_alone, low), numpy.where(alone, top_alone, top)
+
+    def jump(
+        self, idx: numpy.ndarray
+    ) -> tuple[int, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Number of steps to the next event, the athletes of idx by decreasing
+        distance, which of them are alone until then and their highest speeds"""
+        dt = self.dt
+        steps = int(round(self.max_jump / dt))
+        now = self.tick * self.step_ms
+        if len(self.waiting) != 0:
+            # The next athletes start in the step after the jump
+            first = -(-(self.waiting[0][0] - now) // self.step_ms)
+            steps = min(steps, first - 1)
+        if self.every_frame:
+            steps = min(steps, (1000 - now % 1000) // self.step_ms)
+
+        order = idx[numpy.argsort(-self.distances[idx], kind="stable")]
+        distance = self.distances[order]
+        # gap[k] is between the athletes k and k + 1
+        gap = distance[:-1] - distance[1:]
+        close = gap <= 2.0
+        alone = (self.activate_start[order] < 0) & (self.start_boost[order] < 0)
+        alone[:-1] &= ~close
+        alone[1:] &= ~close
+        low, top = self.speed_bounds(order, alone)
+
+        # No athlete alone can finish
+        if alone.any():
+            left = self.distance - distance[alone]
+            steps = min(steps, self.most_steps(left, top[alone]))
+        # No athlete alone can come within 2m of the ones around
+        pair = alone[:-1] | alone[1:]
+        if pair.any():
+            room = gap[pair] - 2.0
+            closing = (top[1:] - low[:-1])[pair]
+            steps = min(steps, self.most_steps(room, closing))
+        return steps, order, alone, top
+
+    def most_steps(self, room: numpy.ndarray, speed: numpy.ndarray) -> int:
+        """Most steps with speed * dt * steps <= room for all the values, room is
+        positive"""
+        with numpy.errstate(divide="ignore"):
+            steps = room / (numpy.maximum(speed, 0) * self.dt)
+        return int(min(steps.min(), self.max_jump / self.dt))
+
+    def update(self) -> None:
+        """Jump to the next event if it is far enough, else same as VectorSim.update"""
+        idx = numpy.flatnonzero(self.is_skiing)
+        if (self.recorder is not None) or (len(idx) == 0) or (self.wait > 0):
+            self.wait -= 1
+            super().update()
+            return
+        steps, order, alone, top = self.jump(idx)
+        if steps < self.min_jump_steps:
+            # In a dense field, looking for a jump costs more than the step
+            self.wait = self.retry
+            self.retry = min(max(2 * self.retry, 1), self.max_retry)
+            super().update()
+            return
+        self.retry = 0
+
+        duration = steps * self.dt
+        group = order[~alone]
+        # The ranks are only needed when an athlete finishes
+        finishing = (
+            self.distances[group] + top[~alone] * duration >= self.distance
+        ).any()
+        # No one can pass an athlete alone during the jump: the athletes between two
+        # of them stay there, even if the distances of the athletes alone are old
+        self.block[order] = 2 * numpy.cumsum(alone) - alone
+        for _ in range(steps):
+            self.next_tick()
+            if len(group) == 0:
+                continue
+            finished = self.advance(group)
+            if len(finished) != 0:
+                self.add_done(finished)
+                group = group[self.is_skiing[group]]
+            if finishing:
+                self.update_rank()
+        self.block[:] = 0
+
+        free = order[alone]
+        energy, distance = ski_alone(
+            self.energies[free], self.avg_speeds[free], duration, self.use_random
+        )
+        self.locked[free] &= numpy.maximum(self.energies[free], energy) <= 70
+        self.distances[free] += distance
+        self.energies[free] = numpy.round(energy, 6)
+        self.times[free] = numpy.round(self.times[free] + duration, 3)
+        self.leaders[free] = -1
+
+        if int(self.t) != int(self.t - duration):
+            self.show_progress()
+        self.finish_update()
+
+    def update_rank(self) -> None:
+        idx = numpy.flatnonzero(self.is_skiing)
+        order = numpy.lexsort((-self.distances[idx], self.block[idx]))
+        self.ranks[idx[order]] = 1 + self.done_count[0] + numpy.arange(len(idx))
+
+    def finish_update(self) -> None:
+        self.update_rank()
+
+        # If no more athletes are running or waiting, the simulation ended
+        if len(self.skiing) == len(self.waiting) == 0:
+            self.ended = True
+
+        # Without every_frame, a jump can skip seconds: the frame is the second
+        if self.on_second():
+            self.frame = int(self.t)
+            self.render_update_data()
+
+
+class EnsembleSim(VectorSim):
+    """Simulate independent replicas of the same race together, each with its own
+    random draws. Only the arrays are updated, there are no Athlete to render."""
+
+    def __init__(
+        self,
+        dt: float,
+        name: str = "",
+        seed: "int | numpy.random.SeedSequence | None" = None,
+        replicas: int = 100,
+    ) -> None:
+        super().__init__(dt, name, seed)
+        self.replicas = replicas
+
+    def start_update(self) -> None:
+        self.next_tick()
+
+        starting = self.starting()
+        if len(starting) != 0:
+            self.enter_all(starting)
+
+        if self.on_second():
+            total = self.num_athlete * self.replicas
+            done = self.done_count.sum()
+            print(f"{utils.time_convert_to_str(self.t)}, {done} / {total}", end="\r")
+
+    def update(self) -> None:
+        """Update the state of all the replicas"""
+        self.start_update()
+
+        idx = numpy.flatnonzero(self.is_skiing)
+        if len(idx) != 0:
+            self.advance(idx)
+
+        self.update_rank()
+        if (len(self.waiting) == 0) and not self.is_skiing.any():
+            self.ended = True
+
+    def num_skiing(self) -> int:
+        return int(self.is_skiing.sum())
+
+    def finishing_orders(self) -> list[list[str]]:
+        """Names of the athletes in simulated finishing order, for each replica"""
+        if not self.ended:
+            raise ValueError("Cannot use this function if the simulation did not end")
+        ranks = self.ranks.reshape(self.replicas, len(self.all_athletes))
+        return [
+            [self.all_athletes[k].name for k in numpy.argsort(r, kind="stable")]
+            for r in ranks
+        ]
+
+    def replica_rates(
+        self,
+    ) -> list[tuple[tuple[int, int, float], tuple[int, int, float]]]:
+        """Return excat_rate and adapt_rate for each replica"""
+        if not self.ended:
+            raise ValueError("Cannot use this function if the simulation did not end")
+        names = [a.name for a in self.all_athletes]
+        expected = [a.expected_rank for a in self.all_athletes]
+        out = []
+        for r in self.ranks.reshape(self.replicas, len(names)).tolist():
+            out.append(
+                (exact_rate(names, expected, r), adapted_rate(names, expected, r))
+            )
+        return out
+
+    def write(self) -> None:
+        """Same as Simulation.write, one block of lines per replica"""
+        file = self.name
+        if file == "":
+            file = "data"
+        num = len(self.all_athletes)
+        with open(file, "a") as f:
+            for r in range(self.replicas):
+                for a in self.all_athletes:
+                    k = r * num + a.index
+                    f.write(
+                        f"{a.name}, {self.ranks[k]}, {a.expected_rank}, {self.times[k]}\n"
+                    )
+
+    def excat_rate(self) -> tuple[int, int, float]:
+        """Sum over all replicas"""
+        rates = [e for e, _ in self.replica_rates()]
+        correct = sum(r[0] for r in rates)
+        total = sum(r[1] for r in rates)
+        return (correct, total, correct / total * 100)
+
+    def adapt_rate(self) -> tuple[int, int, float]:
+        """Sum over all replicas"""
+        rates = [a for _, a in self.replica_rates()]
+        correct = sum(r[0] for r in rates)
+        total = sum(r[1] for r in rates)
+        return (correct, total, correct / total * 100)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import store
+import utils
+
+HEADER = "name,nationality,team,birthdate,rank,bib,jump_points,jump_rank,jump_time_diff,cross_time,cross_rank,time_behind"
+
+
+def parse_date(text: str) -> tuple[int, int, int]:
+    """Convert a date written ddmmyyyy (as in the file names) to (year, month, day)"""
+    return (int(text[4:]), int(text[2:4]), int(text[:2]))
+
+
+def iso_date(date: tuple[int, int, int]) -> str:
+    """(year, month, day) as written in the database, see store.race_info"""
+    return f"{date[0]:04}-{date[1]:02}-{date[2]:02}"
+
+
+def race_files(
+    directories: list[str],
+    since: tuple[int, int, int] | None = None,
+    until: tuple[int, int, int] | None = None,
+) -> list[str]:
+    """Return the races of the folders with since <= date < until.
+    Synthetic startlists (starting with 00) and last.csv are skipped"""
+    files = []
+    for directory in directories:
+        for file in sorted(os.listdir(directory)):
+            if (file[0] == ".") or (file[-4:] != ".csv"):
+                continue
+            if (file[:2] == "00") or (file == "last.csv"):
+                continue
+            if (since is not None) or (until is not None):
+                date = utils.extract_date(file)
+                if (since is not None) and (date < since):
+                    continue
+                if (until is not None) and (date >= until):
+                    continue
+            files.append(os.path.join(directory, file))
+    return files
+
+
+def mean_times(files: list[str]) -> dict[str, tuple[float, float]]:
+    """Mean jump_time_diff and cross_time of each athlete over the races.
+    Each file is read once, and athletes are matched on the whole name"""
+    sums: dict[str, list[float]] = {}
+    for path in files:
+        with open(path) as f:
+            f.readline()  # Header
+            for line in f:
+                values = line.strip().split(",")
+                if len(values) < 10:
+                    continue
+                s = sums.setdefault(values[0], [0.0, 0.0, 0])
+                s[0] += utils.time_convert_to_float(values[8])
+                s[1] += utils.time_convert_to_float(values[9])
+                s[2] += 1
+    return {name: (j / n, c / n) for name, (j, c, n) in sums.items()}
+
+
+def read_names(path: str) -> list[str]:
+    """Names of the athletes in a csv (first column)"""
+    with open(path) as f:
+        lines = f.read().strip().split("\n")[1:]
+    return [line.split(",")[0] for line in lines]
+
+
+def write_startlist(
+    path: str,
+    times: dict[str, tuple[float, float]],
+    athletes: list[str] | None = None,
+    mode: str = "w",
+) -> None:
+    """Write a synthetic race with the mean times of the athletes (all of them if
+    athletes is None). Athletes without any race are skipped"""
+    if athletes is None:
+        athletes = list(times)
+    with open(path, mode) as f:
+        f.write(HEADER + "\n")
+        for a in athletes:
+            if a not in times:
+                continue
+            jump_time_diff, cross_time = times[a]
+            f.write(
+                f"{a},0,0,0,0,0,0,0,{utils.time_convert_to_str(jump_time_diff)},{utils.time_convert_to_str(cross_time)},0,0\n"
+            )
+
+
+if __name__ == "__main__":
+    path = ""
+    directories = []
+    athletes_file = None
+    since = None
+    until = None
+    use_db = False
+    k = 1
+    while k < len(sys.argv):
+        arg = sys.argv[k]
+        if (arg == "-a") or (arg == "--athletes"):
+            k += 1
+            athletes_file = sys.argv[k]
+        elif arg == "--since":
+            k += 1
+            since = parse_date(sys.argv[k])
+        elif arg == "--until":
+            k += 1
+            until = parse_date(sys.argv[k])
+        elif (arg == "-d") or (arg == "--db"):
+            use_db = True
+        elif (arg == "-h") or (arg == "--help"):
+            print("Help for startlist.py")
+            print("startlist.py OUTPUT FOLDER [FOLDER ...] [options]")
+            print("startlist.py OUTPUT --db [options]")
+            print("Write a synthetic race with the mean times of the athletes\n")
+            print("  -a/--athletes [csv]  Only the athletes of this csv (default: all)")
+            print("  --since [ddmmyyyy]   Only the races on or after this date")
+            print("  --until [ddmmyyyy]   Only the races before this date")
+            print("  -d/--db              Use all the races of the database (store.py)")
+            print("                       instead of reading the folders")
+            exit(0)
+        elif path == "":
+            path = arg
+        else:
+            directories.append(arg)
+        k += 1
+
+    if (path == "") or ((len(directories) == 0) != use_db):
+        print("Give the output file and at least one folder or --db, see -h")
+        exit(1)
+    athletes = None
+    if athletes_file is not None:
+        athletes = read_names(athletes_file)
+    if use_db:
+        conn = store.connect()
+        store.ingest(conn)
+        times = store.mean_times(
+            conn,
+            "0000-00-00" if since is None else iso_date(since),
+            "9999-99-99" if until is None else iso_date(until),
+            athletes,
+        )
+        conn.close()
+    else:
+        times = mean_times(race_files(directories, since, until))
+    write_startlist(path, times, athletes)
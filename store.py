@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import sys
+
+import cache
+import utils
+
+csv_dir = "extracted"
+# Hidden, so that main.py does not list it as a race
+db_path = os.path.join(csv_dir, ".results.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime INTEGER NOT NULL,
+    folder TEXT NOT NULL,
+    season TEXT,
+    number INTEGER,
+    date TEXT,
+    venue TEXT,
+    distance INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    race_id INTEGER NOT NULL REFERENCES races(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    nationality TEXT,
+    team TEXT,
+    rank INTEGER,
+    jump_rank INTEGER,
+    jump_time REAL,
+    cross_time REAL
+);
+CREATE INDEX IF NOT EXISTS results_name ON results(name, race_id);
+CREATE INDEX IF NOT EXISTS results_race ON results(race_id);
+CREATE INDEX IF NOT EXISTS races_date ON races(date);
+CREATE INDEX IF NOT EXISTS races_folder ON races(folder, date, number);
+"""
+
+
+def connect(path: str = db_path) -> sqlite3.Connection:
+    """Open the database, creating the tables if needed"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def race_info(path: str) -> tuple[str | None, int | None, str | None, str | None]:
+    """Return the season, number, date (yyyy-mm-dd) and venue of a race from the
+    name of its file and folder. Unknown values are None"""
+    folder = os.path.basename(os.path.dirname(path))
+    file = os.path.basename(path)
+    parts = file.split(" ")
+
+    number = None
+    if parts[0].isdigit():
+        number = int(parts[0])
+
+    date = None
+    venue = None
+    season = None
+    try:
+        year, month, day = utils.extract_date(file)
+        date = f"{year:04}-{month:02}-{day:02}"
+        # The venue is between the distance (if any) and the date
+        end = len(parts) - 2 if parts[-1][0] == "S" else len(parts) - 1
+        start = 1
+        for k in range(end):
+            if parts[k][-2:] == "km":
+                start = k + 1
+        venue = " ".join(parts[start:end])
+        # A season starts in the summer
+        if month >= 7:
+            season = f"{year}_{year + 1}"
+        else:
+            season = f"{year - 1}_{year}"
+    except (ValueError, IndexError):
+        pass
+    if folder[:6].lower() == "season":
+        season = folder[7:].replace(" ", "_")
+    return season, number, date, venue
+
+
+def ingest(conn: sqlite3.Connection, root: str = csv_dir) -> int:
+    """Load all the race csv under root that are new or were modified.
+    Return the number of races loaded"""
+    known = {p: (i, m) for i, p, m in conn.execute("SELECT id, path, mtime FROM races")}
+    seen = set()
+    loaded = 0
+    for directory, dirs, files in os.walk(root):
+        # Skip the cache and other hidden folders
+        dirs[:] = [d for d in dirs if d[0] != "."]
+        for file in sorted(files):
+            if (file[0] == ".") or (file[-4:] != ".csv"):
+                continue
+            path = os.path.join(directory, file)
+            seen.add(path)
+            mtime = os.stat(path).st_mtime_ns
+            if (path in known) and (known[path][1] == mtime):
+                continue
+            if path in known:
+                conn.execute("DELETE FROM races WHERE id = ?", (known[path][0],))
+            try:
+                distance = utils.read_distance(path)
+                table = cache.read_table(path)
+            except (AttributeError, ValueError, KeyError) as e:
+                print(f"Cannot load {path}: {e}")
+                continue
+
+            season, number, date, venue = race_info(path)
+            folder = os.path.relpath(directory, root)
+            race_id = conn.execute(
+                "INSERT INTO races "
+                "(path, mtime, folder, season, number, date, venue, distance) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, mtime, folder, season, number, date, venue, distance),
+            ).lastrowid
+            r = table.records
+            conn.executemany(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                zip(
+                    [race_id] * len(r),
+                    r["name"].tolist(),
+                    r["nationality"].tolist(),
+                    r["team"].tolist(),
+                    r["expected_rank"].tolist(),
+                    r["starting_place"].tolist(),
+                    r["start_time"].tolist(),
+                    r["cross_duration"].tolist(),
+                ),
+            )
+            loaded += 1
+
+    for path in known:
+        if path not in seen:
+            conn.execute("DELETE FROM races WHERE id = ?", (known[path][0],))
+    conn.commit()
+    return loaded
+
+
+def history(
+    conn: sqlite3.Connection, name: str
+) -> list[tuple[str, str, int, int, float, float]]:
+    """Date, venue, distance, rank, jump time difference and cross country time of
+    all the races of an athlete, oldest first"""
+    return conn.execute(
+        "SELECT races.date, races.venue, races.distance, "
+        "results.rank, results.jump_time, results.cross_time "
+        "FROM results JOIN races ON races.id = results.race_id "
+        "WHERE results.name = ? ORDER BY races.date",
+        (name,),
+    ).fetchall()
+
+
+def totals_before(
+    conn: sqlite3.Connection, path: str, by: str = "number"
+) -> dict[str, tuple[float, float]]:
+    """Distance and time of each athlete of the race at path over the races before it
+    in the same folder, ordered by 'number' (season) or 'date' (race folder).
+    Same as season.SeasonIndex.totals_before"""
+    if by not in ("number", "date"):
+        raise ValueError(f"Cannot order the races by '{by}'")
+    row = conn.execute(
+        f"SELECT id, folder, {by} FROM races WHERE path = ?", (path,)
+    ).fetchone()
+    if row is None:
+        raise ValueError(f"{path} is not in the database, use store.ingest")
+    race_id, folder, value = row
+    rows = conn.execute(
+        "SELECT results.name, SUM(races.distance), SUM(results.cross_time) "
+        "FROM results JOIN races ON races.id = results.race_id "
+        f"WHERE races.folder = ? AND races.{by} < ? "
+        "AND results.name IN (SELECT name FROM results WHERE race_id = ?) "
+        "GROUP BY results.name",
+        (folder, value, race_id),
+    )
+    return {name: (float(d), t) for name, d, t in rows}
+
+
+def mean_times(
+    conn: sqlite3.Connection,
+    since: str = "0000-00-00",
+    until: str = "9999-99-99",
+    names: list[str] | None = None,
+) -> dict[str, tuple[float, float]]:
+    """Mean jump time difference and cross country time of each athlete over the
+    races with since <= date < until (yyyy-mm-dd). Only for names if given.
+    Same as startlist.mean_times, the races without a date in their name (such as
+    the synthetic startlists) are not counted"""
+    query = (
+        "SELECT results.name, AVG(results.jump_time), AVG(results.cross_time) "
+        "FROM results JOIN races ON races.id = results.race_id "
+        "WHERE races.date >= ? AND races.date < ?"
+    )
+    params: list[str] = [since, until]
+    if names is not None:
+        query += f" AND results.name IN ({', '.join('?' * len(names))})"
+        params += names
+    rows = conn.execute(query + " GROUP BY results.name", params)
+    return {name: (j, c) for name, j, c in rows}
+
+
+if __name__ == "__main__":
+    conn = connect()
+    loaded = ingest(conn)
+    races = conn.execute("SELECT COUNT(*) FROM races").fetchone()[0]
+    print(f"Loaded {loaded} races, {races} races in {db_path}")
+    if len(sys.argv) > 1:
+        name = " ".join(sys.argv[1:])
+        for date, venue, distance, rank, jump, cross in history(conn, name):
+            jump_time = utils.time_convert_to_str(jump)
+            cross_time = utils.time_convert_to_str(cross)
+            print(
+                f"{date} {venue:20} {distance / 1000:4}km: {rank:02} "
+                f"(+{jump_time}, {cross_time})"
+            )
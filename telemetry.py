@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy
+
+import athlete
+
+
+class Recorder:
+    """Record the evolution of some attributes of the athletes during a simulation.
+    Each channel is an attribute of Athlete (speed, energy, distance, ...) stored in
+    a float32 array of shape (athletes, samples), grown when full."""
+
+    def __init__(
+        self,
+        num_athlete: int,
+        dt: float,
+        interval: float = 0.0,
+        channels: tuple[str, ...] = ("speed", "energy"),
+        capacity: int = 1024,
+    ) -> None:
+        self.channels = channels
+        # Keep one step every 'every' steps of an athlete
+        self.every = max(1, round(interval / dt))
+        self.interval = self.every * dt
+        self.capacity = capacity
+        # Number of steps done and of samples recorded, for each athlete
+        self.steps = numpy.zeros(num_athlete, dtype=int)
+        self.count = numpy.zeros(num_athlete, dtype=int)
+        self.data = {
+            c: numpy.zeros((num_athlete, capacity), dtype=numpy.float32)
+            for c in channels
+        }
+
+    def reserve(self, samples: int) -> None:
+        """Make room for at least 'samples' samples per athlete"""
+        if samples <= self.capacity:
+            return
+        for c in self.channels:
+            data = numpy.zeros((len(self.count), samples), dtype=numpy.float32)
+            data[:, : self.capacity] = self.data[c]
+            self.data[c] = data
+        self.capacity = samples
+
+    def record(self, a: athlete.Athlete) -> None:
+        """Record the channels of an athlete, after one of its steps"""
+        k = a.index
+        step = self.steps[k]
+        self.steps[k] = step + 1
+        if step % self.every != 0:
+            return
+        i = self.count[k]
+        if i >= self.capacity:
+            self.reserve(2 * self.capacity)
+        for c in self.channels:
+            self.data[c][k, i] = getattr(a, c)
+        self.count[k] = i + 1
+
+    def record_arrays(
+        self, idx: numpy.ndarray, values: dict[str, numpy.ndarray]
+    ) -> None:
+        """Same as record for all athletes in idx, values[c][i] is the value of the
+        channel c for the athlete idx[i]"""
+        step = self.steps[idx]
+        self.steps[idx] = step + 1
+        keep = step % self.every == 0
+        idx = idx[keep]
+        i = self.count[idx]
+        if (len(i) != 0) and (i.max() >= self.capacity):
+            self.reserve(2 * self.capacity)
+        for c in self.channels:
+            self.data[c][idx, i] = values[c][keep]
+        self.count[idx] = i + 1
+
+    def get(self, channel: str, index: int) -> numpy.ndarray:
+        """Return the samples of a channel for an athlete"""
+        if channel not in self.data:
+            raise ValueError(f"The channel '{channel}' was not recorded")
+        return self.data[channel][index, : self.count[index]]
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+
+import numpy
+
 
 def time_convert_to_str(time: int | float) -> str:
     """Convert time (in seconds) to a string of format hh:mm:ss
@@ -26,6 +30,13 @@ def extract_date(filename: str) -> tuple[int, int, int]:
     return (year, month, day)
 
 
+def read_distance(path_file: str) -> int:
+    """Return the distance (in m) written at the end of the file name"""
+    if path_file.find("_") == -1:
+        raise AttributeError("Cannot find the distance in the file name")
+    return int(path_file.split("_")[-1].split(".")[0]) * 1000
+
+
 def select(l: list[str]) -> int:
     if len(l) == 1:
         return 0
@@ -52,6 +63,72 @@ def time_convert_to_float(time: str) -> float:
     return float(m) * 60 + float(s)
 
 
+def rank_convert_to_int(rank: str | int) -> int:
+    """Convert a rank to an int, removing the 'PF ' (photo finish) prefix"""
+    if (type(rank) == str) and (rank[:3] == "PF "):
+        rank = rank[3:]
+    return int(rank)
+
+
+class RandomStream:
+    """Uniform random numbers in [0, 1) from a NumPy generator, drawn by blocks so
+    that each number costs about as much as reading a list"""
+
+    def __init__(self, rng: numpy.random.Generator, size: int = 4096) -> None:
+        self.rng = rng
+        self.size = size
+        self.block: list[float] = []
+        self.i = 0
+
+    def random(self) -> float:
+        if self.i == len(self.block):
+            self.block = self.rng.random(self.size).tolist()
+            self.i = 0
+        self.i += 1
+        return self.block[self.i - 1]
+
+
+class Progress:
+    """Progress of a batch of tasks, shown on one line with the rate and the
+    remaining time. Only the process that collects the results should use it"""
+
+    def __init__(self, total: int, unit: str = "frames", every: float = 0.2) -> None:
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        # Do not print more than once every 'every' seconds
+        self.every = every
+        self.start = time.monotonic()
+        self.printed = 0.0
+
+    def line(self) -> str:
+        elapsed = time.monotonic() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0.0
+        return (
+            f"{self.done / max(self.total, 1) * 100:5.1f}% ({self.done} / {self.total}"
+            f" {self.unit}), {rate:.1f} {self.unit}/s, "
+            f"{time_convert_to_str(eta)} left  "
+        )
+
+    def update(self, n: int = 1) -> None:
+        """Add n finished tasks"""
+        self.done += n
+        now = time.monotonic()
+        if (now - self.printed >= self.every) or (self.done >= self.total):
+            self.printed = now
+            print(self.line(), end="\r")
+
+    def finish(self) -> None:
+        """Print the final line, with the total time"""
+        elapsed = time.monotonic() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        print(
+            f"{self.done} {self.unit} in {time_convert_to_str(elapsed)}, "
+            f"{rate:.1f} {self.unit}/s" + " " * 20
+        )
+
+
 class Boost:
     """The boost class. Stores information about each athlete's boost"""
 
@@ -81,3 +158,9 @@ class Boost:
         """Reset a boost"""
         self.activate_start = -1
         self.start_boost = -1
+
+
+def divides_second(dt: float) -> bool:
+    """The athletes start and the frames are taken on whole seconds, and the time
+    is rounded to the millisecond"""
+    return (abs(round(1 / dt) * dt - 1) < 1e-9) and (round(dt, 3) == dt)